@@ -1,12 +1,28 @@
+import hashlib
+import itertools
+import os
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from pathlib import Path
 
 import numpy as np
+import soundfile as sf
 import torch
+import torch.distributed as dist
 import torchaudio
 import torchaudio.transforms as T
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from tqdm import tqdm
 
+# Frames quieter than this (dBFS) are never speech
+VAD_FLOOR_DB = -70.0
+# Rows of AudioDataset.cache_stats: the main process and up to this many
+# DataLoader workers, whatever num_workers the config asks for
+CACHE_STATS_WORKERS = 256
+
 
 @dataclass
 class Config:
@@ -17,6 +33,30 @@ class Config:
     n_lfcc: int = 60
     n_fft: int = 512
     hop_length: int = 160
+    # Return raw waveforms and compute LFCC per batch with LFCCFrontend
+    batched_frontend: bool = False
+    fused_frontend: bool = False
+
+    # Preprocessing Related:
+    # "raw" decodes FLAC per chunk, "pcm" slices the PCM store,
+    # "lfcc" slices the precomputed LFCC store, "stream" streams the protocol,
+    # "shards" reads sequential tar shards written by shards.py
+    data_mode: str = "raw"
+    store_path: str = "./store"
+    pcm_dtype: str = "float32"  # "int16" halves the store size
+    index_cache_path: str | None = "./cache"  # None rebuilds the chunk index every run
+    index_workers: int = 8
+    # Per-worker LRU cache of decoded audio ("raw" mode), 0 disables it
+    audio_cache_mb: int = 0
+    # Files per shuffling group for FileGroupSampler, 0 shuffles chunks freely
+    locality_group_size: int = 0
+    # "stream" mode: chunks held per worker for shuffling, and the expected
+    # chunks per file used to size LR schedules (the length is unknown up front)
+    shuffle_buffer_size: int = 2048
+    stream_chunks_per_file: float = 4.0
+    shard_path: str = "./shards"
+    shard_content: str = "wave"  # or "lfcc"
+    samples_per_shard: int = 4096
 
     idx2class: dict[int, str] = field(
         default_factory=lambda: {0: "bonafide", 1: "spoof"}
@@ -25,6 +65,14 @@ class Config:
         default_factory=lambda: {"bonafide": 0, "spoof": 1}
     )
 
+    # Silence Related (energy VAD, stored per chunk in the chunk index):
+    # Chunks with a speech ratio below this are dropped or down-weighted,
+    # 0 disables the VAD
+    min_speech_ratio: float = 0.0
+    silence_policy: str = "drop"  # or "weight" (scales their training loss)
+    silence_weight: float = 0.1  # loss weight of low-speech chunks for "weight"
+    vad_threshold_db: float = 40.0  # frames this far below the loudest are silence
+
     # Dataloader Related:
     batch_size: int = 64
     num_workers: int = 8
@@ -37,6 +85,64 @@ class Config:
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     save_path: str = "./checkpoints"
     logs_path: str = "./logs"
+    # Resumable checkpoint (last_checkpoint.pth in save_path) every N steps
+    # and at every epoch end; 0 only checkpoints at epoch ends
+    checkpoint_every: int = 500
+    resume: bool = True
+    # torchrun launches one process per rank; gloo runs on CPU-only nodes
+    dist_backend: str = "gloo"
+    # Hard-example sampling (samplers.ImportanceSampler): each epoch draws
+    # importance_fraction of the chunks in proportion to their recent loss
+    importance_sampling: bool = False
+    importance_fraction: float = 0.5  # draws per epoch, as a share of the chunks
+    importance_floor: float = 0.2  # share of the draw probability spread uniformly
+    importance_smoothing: float = 0.5  # EMA weight of a chunk's previous loss
+
+    # Server Related:
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    max_batch_size: int = 64  # chunks per model forward
+    max_wait_ms: float = 5.0  # longest a chunk waits for the batch to fill
+
+    # Streaming Related (streaming.py):
+    stream_cadence: float = 0.5  # seconds of audio between model runs
+    stream_smoothing: float = 0.8  # EMA weight of the previous smoothed score
+    stream_block_ms: float = 20.0  # PCM block size when replaying files
+
+    # Early-exit Utterance Scoring (early_exit.py):
+    early_exit_confidence: float = 0.99  # stop once either class reaches this
+    early_exit_min_chunks: int = 2  # chunks scored before an utterance may stop
+    early_exit_order: str = "spread"  # "spread" (coarse to fine) or "sequential"
+
+    # Batch Scoring Related (score_dir.py):
+    score_workers: int = 8  # decode processes
+    score_group_chunks: int = 1024  # chunks scored and written out together
+
+    # Score Cache Related (score_cache.py, used by inference.py and server.py):
+    score_cache_path: str | None = None  # sqlite file; None disables the cache
+    score_cache_mb: int = 1024  # least recently used entries are evicted beyond this
+
+    # Deployment Related:
+    inference_backend: str = "eager"  # "eager", "int8" or "onnx" (written by export.py)
+    quant_calibration_batches: int = 16  # train batches observed for static int8
+
+    # Precision Related:
+    precision: str = "fp32"  # "bf16" or "fp16" autocast (fp16 adds loss scaling)
+    channels_last: bool = False  # NHWC layout for the conv stack
+
+    # Metrics Related:
+    metric_bins: int = 10000  # EER histogram bins over the spoof log-odds
+    exact_metrics: bool = False  # keep every score for an exact EER instead
+
+    # Compilation Related:
+    compile: bool = False  # torch.compile the model (warm-up runs before the loop)
+    compile_mode: str = "default"  # or "reduce-overhead", "max-autotune"
+
+    # Profiling Related:
+    # Log percentiles of the step phases every N steps, 0 disables the timers
+    timing_log_every: int = 100
+    # torch.profiler window, e.g. (100, 120); writes a Chrome trace to logs_path
+    profile_steps: tuple[int, int] | None = None
 
     # Scheduler Related:
     scheduler_patience: int = 2
@@ -47,14 +153,185 @@ class Config:
     seed: int = 42
 
 
+def iter_protocol(filename, audio_files_base_path):
+    """Yield (file_path, label) for every line of an ASVspoof protocol file."""
+    with open(filename, "r") as f:
+        for line in f:
+            words = line.strip().split()
+            if not words:
+                continue
+            audio_filename = words[1] + ".flac"
+            label = words[-1]
+            full_path = Path(audio_files_base_path) / audio_filename
+            yield str(full_path), label
+
+
+def shuffle_buffer(iterable, buffer_size, rng):
+    """Approximate shuffle of a stream through a `buffer_size` reservoir."""
+    buffer = []
+    for item in iterable:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+            continue
+        pos = rng.randrange(buffer_size)
+        yield buffer[pos]
+        buffer[pos] = item
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def shard_info():
+    """(shard_id, num_shards) of this DataLoader worker across all processes."""
+    rank, world_size = 0, 1
+    if dist.is_available() and dist.is_initialized():
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+    worker_id, num_workers = 0, 1
+    worker_info = get_worker_info()
+    if worker_info is not None:
+        worker_id, num_workers = worker_info.id, worker_info.num_workers
+    return rank * num_workers + worker_id, world_size * num_workers
+
+
+@lru_cache(maxsize=None)
+def _get_resampler(orig_sr, new_sr):
+    return T.Resample(orig_sr, new_sr)
+
+
+def load_audio(file_path, sr):
+    """Decode an audio file (path or file-like object), downmix it to mono and
+    resample it to `sr` as a 1D float32 array."""
+    audio, orig_sr = torchaudio.load(file_path)
+    audio = audio.mean(0)
+    if orig_sr != sr:
+        audio = _get_resampler(orig_sr, sr)(audio)
+    return audio.numpy()
+
+
+def audio_length(file_path, sr):
+    """Number of samples `file_path` has after resampling to `sr`, read from
+    the container header when possible."""
+    try:
+        info = sf.info(file_path)
+    except (sf.LibsndfileError, RuntimeError):
+        return len(load_audio(file_path, sr))
+    # Same rounding as torchaudio's Resample output length
+    return -(-info.frames * sr // info.samplerate)
+
+
+def chunk_starts(total_samples, chunk_samples, step_samples):
+    """Start samples of the overlapping chunks covering `total_samples`."""
+    starts = []
+    start_sample = 0
+    while start_sample + chunk_samples <= total_samples:
+        starts.append(start_sample)
+        start_sample += step_samples
+
+    # Will pad it later
+    if start_sample < total_samples:
+        starts.append(start_sample)
+    return starts
+
+
+def split_chunks(audio, chunk_samples, step_samples):
+    """(samples,) tensor -> (num_chunks, chunk_samples), the last chunk zero-padded."""
+    chunks = []
+    for start_sample in chunk_starts(len(audio), chunk_samples, step_samples):
+        chunk = audio[start_sample : start_sample + chunk_samples]
+        if len(chunk) < chunk_samples:
+            chunk = torch.nn.functional.pad(chunk, (0, chunk_samples - len(chunk)))
+        chunks.append(chunk)
+    if not chunks:
+        return audio.new_zeros(0, chunk_samples)
+    return torch.stack(chunks)
+
+
+def speech_mask(audio, frame_samples, threshold_db):
+    """Energy VAD over non-overlapping `frame_samples` frames: True for frames
+    within `threshold_db` of the file's loudest frame and above VAD_FLOOR_DB,
+    so digital silence is never speech."""
+    num_frames = -(-len(audio) // frame_samples)
+    if num_frames == 0:
+        return np.zeros(0, dtype=bool)
+    frames = np.zeros(num_frames * frame_samples, dtype=np.float32)
+    frames[: len(audio)] = audio
+    power = np.mean(frames.reshape(num_frames, frame_samples) ** 2, axis=1)
+    power_db = 10 * np.log10(power + 1e-12)
+    return (power_db >= power_db.max() - threshold_db) & (power_db > VAD_FLOOR_DB)
+
+
+def chunk_speech_ratios(
+    file_path, sr, chunk_samples, step_samples, frame_samples, threshold_db
+):
+    """(total_samples, speech ratio of every chunk) of `file_path`. The zero
+    padding of the last chunk counts as silence."""
+    audio = load_audio(file_path, sr)
+    speech = speech_mask(audio, frame_samples, threshold_db)
+    speech_before = np.concatenate([[0], np.cumsum(speech)])
+    starts = np.array(
+        chunk_starts(len(audio), chunk_samples, step_samples), dtype=np.int64
+    )
+    first_frame = starts // frame_samples
+    end_frame = np.minimum((starts + chunk_samples) // frame_samples, len(speech))
+    ratios = (speech_before[end_frame] - speech_before[first_frame]) / (
+        chunk_samples // frame_samples
+    )
+    return len(audio), ratios.astype(np.float32)
+
+
+def to_model_layout(lfcc):
+    """(..., n_lfcc, time_frames) -> (..., 1, n_lfcc, time_frames) as LCNN expects."""
+    return lfcc.unsqueeze(-3)
+
+
 class AudioDataset(Dataset):
-    def __init__(self, audio_list, config) -> None:
+    """Overlapping fixed-length chunks of every file in `audio_list`.
+
+    With `min_speech_ratio > 0`, the chunk index also holds each chunk's
+    speech ratio from an energy VAD (computed while indexing and cached with
+    it). Low-speech chunks are then left out of the index (`silence_policy
+    = "drop"`; every file keeps its most speech-like chunk), or kept with
+    weight `silence_weight`, which items carry as a third element when
+    `return_weight` is set.
+    """
+
+    def __init__(
+        self, audio_list, config, pcm_store=None, lfcc_store=None, return_weight=False
+    ) -> None:
         super().__init__()
         self.data = audio_list
         self.sr = config.sr
         self.chunk_length = config.chunk_length
         self.chunk_overlap = config.chunk_overlap
         self.class2idx = config.class2idx
+        self.pcm_store = pcm_store
+        self.lfcc_store = lfcc_store
+        self.hop_length = config.hop_length
+        self.step_samples = int(self.chunk_length * self.sr) - int(
+            self.chunk_overlap * self.sr
+        )
+        self.return_waveform = config.batched_frontend and lfcc_store is None
+        self.index_cache_path = config.index_cache_path
+        self.index_workers = config.index_workers
+        self.min_speech_ratio = config.min_speech_ratio
+        self.vad = config.min_speech_ratio > 0
+        self.vad_threshold_db = config.vad_threshold_db
+        self.silence_policy = config.silence_policy
+        self.silence_weight = config.silence_weight
+        if self.silence_policy not in ("drop", "weight"):
+            raise ValueError(f"Unsupported silence_policy: {self.silence_policy}")
+        self.return_weight = return_weight
+        self.speech_ratios = None
+        self.chunk_weights = None
+        self._silence_stats = None
+
+        self.cache_bytes = config.audio_cache_mb * 2**20
+        self._audio_cache = OrderedDict()
+        self._audio_cache_size = 0
+        # Per-worker (hits, misses, bytes) in shared memory so the main process
+        # can report them; row 0 is the main process itself. Allocated before
+        # any DataLoader exists, so not sized by config.num_workers
+        self.cache_stats = torch.zeros(CACHE_STATS_WORKERS + 1, 3, dtype=torch.int64)
+        self.cache_stats.share_memory_()
 
         self.lfcc = T.LFCC(
             sample_rate=self.sr,
@@ -65,56 +342,268 @@ class AudioDataset(Dataset):
         self.chunk_index = []
         self._build_chunk_index()
 
+    def _index_cache_file(self):
+        # Stores know their lengths; only the VAD is worth caching for them
+        if self.index_cache_path is None or (
+            self._store() is not None and not self.vad
+        ):
+            return None
+        key = hashlib.sha256(
+            f"{self.sr}:{self.chunk_length}:{self.chunk_overlap}".encode()
+        )
+        if self.vad:
+            key.update(f":vad:{self.hop_length}:{self.vad_threshold_db}".encode())
+        for file_path, label in self.data:
+            mtime = os.stat(file_path).st_mtime_ns
+            key.update(f"\n{file_path}\t{label}\t{mtime}".encode())
+        return Path(self.index_cache_path) / f"chunk_index_{key.hexdigest()[:16]}.npz"
+
+    def _store(self):
+        return self.lfcc_store if self.lfcc_store is not None else self.pcm_store
+
+    def _file_lengths(self):
+        file_paths = [file_path for file_path, _ in self.data]
+        if self._store() is not None:
+            return [self._store().num_samples(file_path) for file_path in file_paths]
+
+        with ProcessPoolExecutor(max_workers=self.index_workers) as executor:
+            lengths = executor.map(
+                audio_length, file_paths, [self.sr] * len(file_paths), chunksize=64
+            )
+            return list(tqdm(lengths, total=len(file_paths), desc="Indexing"))
+
+    def _file_speech_ratios(self, chunk_samples, step_samples):
+        """[(total_samples, per-chunk speech ratios)] of every file. The VAD
+        needs the samples, so each file is decoded once in the index pool."""
+        file_paths = [file_path for file_path, _ in self.data]
+        index_file = partial(
+            chunk_speech_ratios,
+            sr=self.sr,
+            chunk_samples=chunk_samples,
+            step_samples=step_samples,
+            frame_samples=self.hop_length,
+            threshold_db=self.vad_threshold_db,
+        )
+        with ProcessPoolExecutor(max_workers=self.index_workers) as executor:
+            results = executor.map(index_file, file_paths, chunksize=64)
+            return list(tqdm(results, total=len(file_paths), desc="Indexing (VAD)"))
+
     def _build_chunk_index(self):
         chunk_samples = int(self.chunk_length * self.sr)
         overlap_samples = int(self.chunk_overlap * self.sr)
         step_samples = chunk_samples - overlap_samples
 
-        for file_idx in tqdm(range(len(self.data))):
-            file_path, label = self.data[file_idx]
-            label = self.class2idx[label]
+        cache_file = self._index_cache_file()
+        if cache_file is not None and cache_file.exists():
+            index = dict(np.load(cache_file))
+        else:
+            if self.vad:
+                files = self._file_speech_ratios(chunk_samples, step_samples)
+            else:
+                files = [(length, None) for length in self._file_lengths()]
+            file_indices, start_samples, speech_ratios = [], [], []
+            for file_idx, (total_samples, ratios) in enumerate(files):
+                # Create overlapping chunks
+                starts = chunk_starts(total_samples, chunk_samples, step_samples)
+                file_indices.extend([file_idx] * len(starts))
+                start_samples.extend(starts)
+                if ratios is not None:
+                    speech_ratios.extend(ratios)
+
+            index = {
+                "file_idx": np.array(file_indices, dtype=np.int64),
+                "start_sample": np.array(start_samples, dtype=np.int64),
+            }
+            if self.vad:
+                index["speech_ratio"] = np.array(speech_ratios, dtype=np.float32)
+            if cache_file is not None:
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file = cache_file.with_suffix(".tmp.npz")
+                np.savez(tmp_file, **index)
+                tmp_file.replace(cache_file)
 
-            # Load audio
-            audio, sr = torchaudio.load(file_path)
-            if sr != self.sr:
-                resampler = torchaudio.transforms.Resample(sr, self.sr)
-                audio = resampler(audio)
-            audio = audio.squeeze().numpy()
-            total_samples = len(audio)
+        file_indices, start_samples = index["file_idx"], index["start_sample"]
+        if self.vad:
+            keep = self._apply_silence_policy(file_indices, index["speech_ratio"])
+            file_indices, start_samples = file_indices[keep], start_samples[keep]
 
-            # Create overlapping chunks
-            start_sample = 0
-            while start_sample + chunk_samples <= total_samples:
-                self.chunk_index.append((file_path, label, start_sample))
-                start_sample += step_samples
+        labels = [self.class2idx[label] for _, label in self.data]
+        self.chunk_index = [
+            (self.data[file_idx][0], labels[file_idx], start_sample)
+            for file_idx, start_sample in zip(
+                file_indices.tolist(), start_samples.tolist()
+            )
+        ]
 
-            # Will pad it later
-            if start_sample < total_samples:
-                self.chunk_index.append((file_path, label, start_sample))
+    def _apply_silence_policy(self, file_indices, speech_ratios):
+        """Sets the per-chunk speech ratios and weights; returns the mask of
+        chunks that stay in the index."""
+        low_speech = speech_ratios < self.min_speech_ratio
+        keep = np.ones(len(speech_ratios), dtype=bool)
+        if self.silence_policy == "drop":
+            keep = ~low_speech
+            # Every file keeps its most speech-like chunk, so none disappears
+            order = np.lexsort((-speech_ratios, file_indices))
+            first_of_file = np.ones(len(order), dtype=bool)
+            first_of_file[1:] = file_indices[order][1:] != file_indices[order][:-1]
+            keep[order[first_of_file]] = True
+        weights = np.where(low_speech, self.silence_weight, 1.0).astype(np.float32)
+        self.speech_ratios = speech_ratios[keep]
+        self.chunk_weights = weights[keep]
+        self._silence_stats = {
+            "chunks": len(keep),
+            "low_speech": int(low_speech.sum()),
+            "dropped": int((~keep).sum()),
+        }
+        return keep
+
+    def silence_report(self):
+        """Low-speech and dropped chunk counts, and the share of per-chunk
+        LFCC and model work the drops save; None without the VAD."""
+        if self._silence_stats is None:
+            return None
+        stats = dict(self._silence_stats)
+        stats["saved"] = stats["dropped"] / max(stats["chunks"], 1)
+        return stats
 
     def _extract_chunk(self, audio_path, start_sample):
-        audio, sr = torchaudio.load(audio_path)
-        if sr != self.sr:
-            resampler = torchaudio.transforms.Resample(sr, self.sr)
-            audio = resampler(audio)
-        audio = audio.squeeze().numpy()
-
-        end_sample = start_sample + int(self.chunk_length * self.sr)
-        chunk = audio[start_sample:end_sample]
+        chunk_samples = int(self.chunk_length * self.sr)
+        end_sample = start_sample + chunk_samples
+        if self.pcm_store is not None:
+            chunk = self.pcm_store.read(audio_path, start_sample, chunk_samples)
+        else:
+            chunk = self._load_audio(audio_path)[start_sample:end_sample]
         if len(chunk) < (end_sample - start_sample):
             pad_width = end_sample - start_sample - len(chunk)
             chunk = np.pad(chunk, (0, pad_width), mode="constant")
         return chunk
 
+    def _load_audio(self, file_path):
+        if self.cache_bytes <= 0:
+            return load_audio(file_path, self.sr)
+
+        worker_info = get_worker_info()
+        row = 0
+        if worker_info is not None:
+            # Workers past the table share rows; counts stay close, not exact
+            row = worker_info.id % CACHE_STATS_WORKERS + 1
+        stats = self.cache_stats[row]
+        audio = self._audio_cache.get(file_path)
+        if audio is not None:
+            self._audio_cache.move_to_end(file_path)
+            stats[0] += 1
+            return audio
+
+        stats[1] += 1
+        audio = load_audio(file_path, self.sr)
+        self._audio_cache[file_path] = audio
+        self._audio_cache_size += audio.nbytes
+        while self._audio_cache_size > self.cache_bytes and len(self._audio_cache) > 1:
+            _, evicted = self._audio_cache.popitem(last=False)
+            self._audio_cache_size -= evicted.nbytes
+        stats[2] = self._audio_cache_size
+        return audio
+
+    def cache_report(self):
+        """Hit rate and memory of the audio caches since the last report."""
+        hits, misses = self.cache_stats[:, :2].sum(dim=0).tolist()
+        report = {
+            "hit_rate": hits / max(hits + misses, 1),
+            "decodes": misses,
+            "cache_mb": self.cache_stats[:, 2].sum().item() / 2**20,
+        }
+        self.cache_stats.zero_()
+        return report
+
     def __len__(self):
         return len(self.chunk_index)
 
     def __getitem__(self, idx):
-        file_path, label, start_sample = self.chunk_index[idx]
-        chunk = self._extract_chunk(file_path, start_sample)
+        inputs, label_tensor = self._chunk(idx)
+        if self.return_weight:
+            weight = 1.0 if self.chunk_weights is None else self.chunk_weights[idx]
+            return inputs, label_tensor, torch.tensor(weight, dtype=torch.float32)
+        return inputs, label_tensor
 
-        chunk_tensor = torch.tensor(chunk, dtype=torch.float32)
+    def _chunk(self, idx):
+        file_path, label, start_sample = self.chunk_index[idx]
         label_tensor = torch.tensor(label, dtype=torch.float32)
 
-        chunk_lfcc = self.lfcc(chunk_tensor).unsqueeze(0)  # (1, n_lfcc, time_frames)
-        return chunk_lfcc, label_tensor
+        if self.lfcc_store is not None:
+            # One row per chunk, and chunks start every step_samples
+            frames = self.lfcc_store.read(
+                file_path, start_sample // self.step_samples, 1
+            )
+            chunk_lfcc = torch.from_numpy(frames[0]).float().T  # (n_lfcc, time_frames)
+        else:
+            chunk = self._extract_chunk(file_path, start_sample)
+            chunk_tensor = torch.as_tensor(chunk, dtype=torch.float32)
+            if self.return_waveform:
+                return chunk_tensor, label_tensor
+            chunk_lfcc = self.lfcc(chunk_tensor)
+
+        return to_model_layout(chunk_lfcc), label_tensor
+
+
+class StreamingAudioDataset(IterableDataset):
+    """Streams protocol entries instead of indexing them up front.
+    Every file is decoded once and all of its chunks are emitted through a
+    per-worker shuffle buffer. Protocol lines are sharded round-robin over
+    DataLoader workers and distributed ranks.
+    """
+
+    def __init__(self, protocols, config, shuffle=False) -> None:
+        super().__init__()
+        self.protocols = protocols  # [(protocol_file, audio_files_base_path)]
+        self.config = config
+        self.sr = config.sr
+        self.chunk_samples = int(config.chunk_length * config.sr)
+        self.step_samples = self.chunk_samples - int(config.chunk_overlap * config.sr)
+        self.class2idx = config.class2idx
+        self.shuffle = shuffle
+        self.seed = config.seed
+        self.epoch = 0
+        self.return_waveform = config.batched_frontend
+
+        self.lfcc = T.LFCC(
+            sample_rate=self.sr,
+            n_lfcc=config.n_lfcc,
+            speckwargs={"n_fft": config.n_fft, "hop_length": config.hop_length},
+        )
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def num_entries(self):
+        """Protocol lines across all shards (cheap, nothing is decoded)."""
+        return sum(1 for protocol in self.protocols for _ in iter_protocol(*protocol))
+
+    def expected_num_chunks(self):
+        return self.num_entries() * self.config.stream_chunks_per_file
+
+    def _entries(self):
+        shard_id, num_shards = shard_info()
+        entries = itertools.chain.from_iterable(
+            iter_protocol(*protocol) for protocol in self.protocols
+        )
+        return itertools.islice(entries, shard_id, None, num_shards)
+
+    def _chunks(self):
+        for file_path, label in self._entries():
+            audio = torch.from_numpy(load_audio(file_path, self.sr))
+            for chunk in split_chunks(audio, self.chunk_samples, self.step_samples):
+                yield chunk, self.class2idx[label]
+
+    def __iter__(self):
+        chunks = self._chunks()
+        if self.shuffle:
+            shard_id, _ = shard_info()
+            rng = random.Random(f"{self.seed}:{self.epoch}:{shard_id}")
+            chunks = shuffle_buffer(chunks, self.config.shuffle_buffer_size, rng)
+
+        for chunk, label in chunks:
+            label_tensor = torch.tensor(label, dtype=torch.float32)
+            if self.return_waveform:
+                yield chunk, label_tensor
+            else:
+                yield to_model_layout(self.lfcc(chunk)), label_tensor
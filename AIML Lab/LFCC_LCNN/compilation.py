@@ -0,0 +1,46 @@
+import copy
+import time
+
+import torch
+from audio_dataset import to_model_layout
+from precision import autocast
+
+
+def example_batch(config):
+    """Zero batch in the model layout, shaped like a full training batch."""
+    time_frames = int(config.chunk_length * config.sr) // config.hop_length + 1
+    inputs = to_model_layout(
+        torch.zeros(config.batch_size, config.n_lfcc, time_frames, device=config.device)
+    )
+    if getattr(config, "channels_last", False):
+        inputs = inputs.contiguous(memory_format=torch.channels_last)
+    return inputs
+
+
+def compile_model(model, config, modes=("eval",)):
+    """Compile `model` in place with `config.compile_mode` and warm it up.
+    Compilation is lazy, so a dummy batch is run once in each of `modes`
+    ("train" also runs backward) to pay for it before the timed loop.
+    Parameters, BatchNorm statistics and gradients are restored afterwards.
+    Returns the warm-up time in seconds.
+    """
+    model.compile(mode=config.compile_mode)
+    state = copy.deepcopy(model.state_dict())
+    was_training = model.training
+    inputs = example_batch(config)
+
+    start_time = time.perf_counter()
+    for mode in modes:
+        model.train(mode == "train")
+        with torch.set_grad_enabled(mode == "train"), autocast(config):
+            outputs = model(inputs)
+        if mode == "train":
+            outputs.float().sum().backward()
+    if config.device.type == "cuda":
+        torch.cuda.synchronize()
+    warmup_seconds = time.perf_counter() - start_time
+
+    model.zero_grad(set_to_none=True)
+    model.load_state_dict(state)
+    model.train(was_training)
+    return warmup_seconds
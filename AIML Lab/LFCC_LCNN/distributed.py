@@ -0,0 +1,102 @@
+import os
+from contextlib import contextmanager
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DistributedSampler, Sampler
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def init_distributed(config):
+    """Join the process group when started by torchrun (WORLD_SIZE > 1).
+    CPU threads are split between the processes of a node, and on GPU nodes
+    each process takes the device of its local rank.
+    Returns (rank, world_size).
+    """
+    world_size = int(os.environ.get("WORLD_SIZE", 1))
+    if world_size == 1:
+        return 0, 1
+
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", world_size))
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    if config.device.type == "cuda":
+        config.device = torch.device("cuda", local_rank)
+        torch.cuda.set_device(config.device)
+    dist.init_process_group(backend=config.dist_backend)
+    return dist.get_rank(), dist.get_world_size()
+
+
+def cleanup_distributed():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+@contextmanager
+def main_process_first():
+    """Let rank 0 build shared caches/stores before the other ranks read them."""
+    if not is_main_process():
+        dist.barrier()
+    yield
+    if is_main_process() and is_distributed():
+        dist.barrier()
+
+
+def broadcast_object(obj):
+    """Rank 0's `obj` on every rank (so only rank 0 needs the file)."""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
+
+
+class ResumableDistributedSampler(DistributedSampler):
+    """DistributedSampler whose epoch can start at `start` samples into this
+    rank's share, mirroring `EpochRandomSampler.set_epoch(epoch, start)`."""
+
+    def __init__(self, dataset, shuffle=True, seed=0):
+        super().__init__(dataset, shuffle=shuffle, seed=seed)
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        super().set_epoch(epoch)
+        self.start = start
+
+    def __iter__(self):
+        return iter(list(super().__iter__())[self.start :])
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+
+class EvalShardSampler(Sampler):
+    """Every `num_replicas`-th index from `rank`, in order. Unlike
+    DistributedSampler it does not pad the shares to equal length, so
+    metrics summed over ranks see each sample exactly once."""
+
+    def __init__(self, num_samples, num_replicas=None, rank=None):
+        self.num_samples = num_samples
+        self.num_replicas = get_world_size() if num_replicas is None else num_replicas
+        self.rank = get_rank() if rank is None else rank
+
+    def __iter__(self):
+        return iter(range(self.rank, self.num_samples, self.num_replicas))
+
+    def __len__(self):
+        return len(range(self.rank, self.num_samples, self.num_replicas))
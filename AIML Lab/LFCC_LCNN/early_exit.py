@@ -0,0 +1,256 @@
+import time
+from pathlib import Path
+
+import torch
+from audio_dataset import (
+    Config,
+    iter_protocol,
+    load_audio,
+    split_chunks,
+    to_model_layout,
+)
+from frontend import LFCCFrontend
+from inference import load_model
+from logger import setup_logger
+from metrics import MetricsAccumulator
+from precision import autocast
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+logger = setup_logger("early_exit")
+
+
+def coarse_to_fine(num_chunks):
+    """Chunk order that covers the whole utterance early: the first chunk,
+    then the midpoints of ever finer halves (0, 4, 2, 1, 3 for 5 chunks)."""
+    order = []
+    seen = set()
+    step = 1 << max(num_chunks - 1, 0).bit_length()
+    while step >= 1:
+        for chunk_idx in range(0, num_chunks, step):
+            if chunk_idx not in seen:
+                seen.add(chunk_idx)
+                order.append(chunk_idx)
+        step //= 2
+    return order
+
+
+def chunk_order(num_chunks, mode):
+    if mode == "spread":
+        return coarse_to_fine(num_chunks)
+    if mode == "sequential":
+        return list(range(num_chunks))
+    raise ValueError(f"Unsupported early_exit_order: {mode}")
+
+
+class UtteranceChunks(Dataset):
+    """Every chunk of an utterance as a (num_chunks, chunk_samples) waveform
+    tensor, cut the same way as AudioDataset cuts it."""
+
+    def __init__(self, audio_list, config) -> None:
+        super().__init__()
+        self.data = audio_list
+        self.sr = config.sr
+        self.chunk_samples = int(config.chunk_length * config.sr)
+        self.step_samples = self.chunk_samples - int(config.chunk_overlap * config.sr)
+        self.class2idx = config.class2idx
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx):
+        file_path, label = self.data[idx]
+        audio = torch.from_numpy(load_audio(file_path, self.sr))
+        chunks = split_chunks(audio, self.chunk_samples, self.step_samples)
+        return chunks, self.class2idx[label]
+
+
+def collate_utterance_chunks(batch):
+    """Utterances have different chunk counts, so a batch stays a list."""
+    return batch
+
+
+class EarlyExitScorer:
+    """Scores utterances from a running mean of their chunk logits and stops
+    as soon as the verdict is settled.
+
+    A group of utterances is scored in rounds: each round runs one batched
+    LFCC + model forward over the next chunk (in `early_exit_order`) of every
+    utterance still open. After at least `early_exit_min_chunks` chunks, an
+    utterance is closed once the softmax of its mean logits puts either
+    class at `early_exit_confidence` or above; the remaining chunks are
+    never decoded into LFCC or run through the model. Scoring all chunks
+    gives the same mean logits as `run_inference`'s chunks averaged per
+    utterance.
+    """
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+        self.confidence = config.early_exit_confidence
+        self.min_chunks = config.early_exit_min_chunks
+        self.order = config.early_exit_order
+        self.frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+        self.model_seconds = 0.0
+
+    def _forward(self, chunks):
+        """(batch, chunk_samples) waveforms -> (batch, num_classes) fp32 logits on CPU."""
+        config = self.config
+        if config.device.type == "cuda":
+            torch.cuda.synchronize()
+        start_time = time.perf_counter()
+        inputs = to_model_layout(self.frontend(chunks.to(config.device)))
+        if getattr(config, "channels_last", False):
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        with autocast(config):
+            outputs = self.model(inputs)
+        outputs = outputs.float().cpu()
+        self.model_seconds += time.perf_counter() - start_time
+        return outputs
+
+    def _settled(self, logit_sum, num_scored):
+        probabilities = torch.softmax(logit_sum / num_scored, dim=0)
+        return bool(probabilities.max() >= self.confidence)
+
+    def score(self, utterances, full=False):
+        """`utterances` is a list of (num_chunks, chunk_samples) tensors.
+        Returns (exit_logits, exit_chunks, full_logits): the mean logits and
+        chunk count at which each utterance stopped and, with `full=True`,
+        the mean logits over all of its chunks (else None). `full=True` keeps
+        scoring past the exit point, so both verdicts come from one pass."""
+        num_utterances = len(utterances)
+        orders = [chunk_order(len(chunks), self.order) for chunks in utterances]
+        num_scored = [0] * num_utterances
+        exit_chunks = [None] * num_utterances
+        logit_sums = [None] * num_utterances
+        exit_logits = [None] * num_utterances
+
+        open_idx = [idx for idx in range(num_utterances) if len(utterances[idx])]
+        with torch.no_grad():
+            while open_idx:
+                batch = torch.stack(
+                    [utterances[idx][orders[idx][num_scored[idx]]] for idx in open_idx]
+                )
+                outputs = self._forward(batch)
+
+                still_open = []
+                for row, idx in enumerate(open_idx):
+                    if logit_sums[idx] is None:
+                        logit_sums[idx] = outputs[row].clone()
+                    else:
+                        logit_sums[idx] += outputs[row]
+                    num_scored[idx] += 1
+                    count = num_scored[idx]
+                    if exit_chunks[idx] is None and (
+                        count == len(utterances[idx])
+                        or (
+                            count >= self.min_chunks
+                            and self._settled(logit_sums[idx], count)
+                        )
+                    ):
+                        exit_chunks[idx] = count
+                        exit_logits[idx] = logit_sums[idx] / count
+                    if count < len(utterances[idx]) and (
+                        full or exit_chunks[idx] is None
+                    ):
+                        still_open.append(idx)
+                open_idx = still_open
+
+        # Utterances shorter than one chunk have no logits; score them 50/50
+        num_classes = next((s.numel() for s in logit_sums if s is not None), 2)
+        for idx in range(num_utterances):
+            if logit_sums[idx] is None:
+                logit_sums[idx] = exit_logits[idx] = torch.zeros(num_classes)
+                exit_chunks[idx] = num_scored[idx] = 1
+        full_logits = None
+        if full:
+            full_logits = torch.stack(
+                [logit_sums[idx] / num_scored[idx] for idx in range(num_utterances)]
+            )
+        return torch.stack(exit_logits), torch.tensor(exit_chunks), full_logits
+
+
+def run_early_exit(audio_list, model_path, config, compare=True):
+    """Score `audio_list` per utterance with early exit and log how many
+    chunks were skipped. `compare=True` also scores every chunk in the same
+    pass and logs the EER and accuracy of early exit against full scoring;
+    the time saved is then not realized, so use `compare=False` for bulk
+    screening."""
+    dataloader = DataLoader(
+        UtteranceChunks(audio_list, config),
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+        collate_fn=collate_utterance_chunks,
+    )
+    scorer = EarlyExitScorer(load_model(model_path, config), config)
+
+    def make_metrics():
+        return MetricsAccumulator(
+            positive_class=config.class2idx["spoof"],
+            num_bins=config.metric_bins,
+            exact=config.exact_metrics,
+        )
+
+    early_metrics = make_metrics()
+    full_metrics = make_metrics() if compare else None
+    total_chunks = 0
+    scored_chunks = 0
+    start_time = time.perf_counter()
+    for batch in tqdm(dataloader, desc="Scoring utterances"):
+        utterances = [chunks for chunks, _ in batch]
+        targets = torch.tensor([label for _, label in batch])
+        exit_logits, exit_chunks, full_logits = scorer.score(utterances, full=compare)
+        early_metrics.update(exit_logits, targets)
+        if compare:
+            full_metrics.update(full_logits, targets)
+        total_chunks += sum(max(len(chunks), 1) for chunks in utterances)
+        scored_chunks += int(exit_chunks.sum())
+    elapsed = time.perf_counter() - start_time
+
+    early = early_metrics.compute()
+    skipped = 1 - scored_chunks / max(total_chunks, 1)
+    logger.info(
+        f"Early exit ({config.early_exit_order}, confidence "
+        f"{config.early_exit_confidence}, min {config.early_exit_min_chunks} chunks) - "
+        f"Accuracy: {early['accuracy']:.2f}%%, EER: {early['eer']:.4f}, "
+        f"Chunks scored: {scored_chunks}/{total_chunks} ({skipped:.1%} skipped)"
+    )
+    results = {
+        "accuracy": early["accuracy"],
+        "eer": early["eer"],
+        "scored_chunks": scored_chunks,
+        "total_chunks": total_chunks,
+        "skipped_fraction": skipped,
+    }
+    if compare:
+        full = full_metrics.compute()
+        logger.info(
+            f"All chunks - Accuracy: {full['accuracy']:.2f}%%, EER: {full['eer']:.4f} | "
+            f"Early exit EER difference: {early['eer'] - full['eer']:+.4f}, "
+            f"Accuracy difference: {early['accuracy'] - full['accuracy']:+.2f}"
+        )
+        results["full_accuracy"] = full["accuracy"]
+        results["full_eer"] = full["eer"]
+    else:
+        logger.info(
+            f"Scored {len(audio_list)} utterances in {elapsed:.1f}s "
+            f"(model {scorer.model_seconds:.1f}s)"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    config = Config()
+    audio_list = list(
+        iter_protocol(
+            Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.eval.trl.txt"),
+            Path("../PA/ASVspoof2019_PA_eval/flac"),
+        )
+    )
+    run_early_exit(audio_list, config.save_path + "/best_model.pth", config)
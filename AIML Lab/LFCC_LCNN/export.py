@@ -0,0 +1,135 @@
+import os
+from dataclasses import replace
+from pathlib import Path
+
+import torch
+from audio_dataset import AudioDataset, Config, iter_protocol
+from compilation import example_batch
+from inference import backend_path, load_model, run_inference
+from logger import setup_logger
+from torch.utils.data import DataLoader
+
+logger = setup_logger("export")
+
+
+def cpu_config(config, **changes):
+    """Copy of `config` for CPU scoring (`device` is not a dataclass field)."""
+    config = replace(config, **changes)
+    config.device = torch.device("cpu")
+    return config
+
+
+def quantize_int8(model, config, calibration_list):
+    """Static INT8 LCNN (FX graph mode, x86 backend): convolutions, pools and
+    the linear head run on quantized tensors. Activation ranges are observed
+    on `quant_calibration_batches` shuffled batches of `calibration_list`."""
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = "x86"
+    prepared = prepare_fx(
+        model,
+        get_default_qconfig_mapping("x86"),
+        example_inputs=(example_batch(config),),
+    )
+    dataset = AudioDataset(
+        calibration_list, config=replace(config, batched_frontend=False)
+    )
+    dataloader = DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+        shuffle=True,
+        generator=torch.Generator().manual_seed(config.seed),
+    )
+    with torch.no_grad():
+        for batch_idx, (inputs, _) in enumerate(dataloader):
+            if batch_idx == config.quant_calibration_batches:
+                break
+            prepared(inputs)
+    return convert_fx(prepared)
+
+
+def export_onnx(model, config, path):
+    """fp32 ONNX graph with a dynamic batch dimension, weights inlined."""
+    batch = torch.export.Dim("batch")
+    torch.onnx.export(
+        model,
+        (example_batch(config),),
+        str(path),
+        input_names=["features"],
+        output_names=["logits"],
+        dynamic_shapes=({0: batch},),
+        dynamo=True,
+        external_data=False,
+    )
+
+
+def export_all(model_path, config, calibration_list):
+    """Write the int8 and ONNX variants of the checkpoint at `model_path`."""
+    config = cpu_config(config, inference_backend="eager", compile=False)
+    export_onnx(
+        load_model(model_path, config), config, backend_path(model_path, "onnx")
+    )
+    logger.info(f"Exported ONNX model to {backend_path(model_path, 'onnx')}")
+
+    quantized = quantize_int8(load_model(model_path, config), config, calibration_list)
+    # Quantized FX modules do not pickle back, so ship a TorchScript trace
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized, (example_batch(config),))
+    torch.jit.save(traced, str(backend_path(model_path, "int8")))
+    logger.info(f"Saved int8 model to {backend_path(model_path, 'int8')}")
+
+
+def parity_report(audio_list, model_path, config, store_name="dev"):
+    """Score `audio_list` with every backend and log EER/accuracy deltas,
+    speedup and size of int8 and ONNX against the fp32 checkpoint. The
+    score cache is bypassed so that every backend actually runs."""
+    results = {}
+    for backend in ("eager", "int8", "onnx"):
+        backend_config = cpu_config(
+            config,
+            inference_backend=backend,
+            precision="fp32",
+            compile=False,
+            score_cache_path=None,
+        )
+        results[backend] = run_inference(
+            audio_list, model_path, backend_config, store_name
+        )
+        results[backend]["size_mb"] = (
+            os.path.getsize(backend_path(model_path, backend)) / 2**20
+        )
+
+    baseline = results["eager"]
+    for backend in ("int8", "onnx"):
+        result = results[backend]
+        logger.info(
+            f"{backend} vs fp32 - "
+            f"EER difference: {result['eer'] - baseline['eer']:+.4f}, "
+            f"Accuracy difference: {result['accuracy'] - baseline['accuracy']:+.2f}, "
+            f"Speedup: {result['throughput'] / baseline['throughput']:.2f}x, "
+            f"Size: {result['size_mb']:.2f} MB (fp32 {baseline['size_mb']:.2f} MB)"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    config = Config()
+    model_path = config.save_path + "/best_model.pth"
+    protocols = Path("../PA/ASVspoof2019_PA_cm_protocols")
+    train_list = list(
+        iter_protocol(
+            protocols / "ASVspoof2019.PA.cm.train.trn2.txt",
+            Path("../PA/ASVspoof2019_PA_train/flac"),
+        )
+    )
+    dev_list = list(
+        iter_protocol(
+            protocols / "ASVspoof2019.PA.cm.dev.trl2.txt",
+            Path("../PA/ASVspoof2019_PA_dev/flac"),
+        )
+    )
+
+    export_all(model_path, config, calibration_list=train_list)
+    parity_report(dev_list, model_path, config)
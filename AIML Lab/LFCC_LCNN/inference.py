@@ -1,11 +1,18 @@
+import itertools
+import time
+from dataclasses import replace
 from pathlib import Path
 
-import numpy as np
 import torch
-from audio_dataset import AudioDataset, Config
+from audio_dataset import AudioDataset, Config, iter_protocol, to_model_layout
+from audio_store import build_lfcc_store, build_pcm_store
+from compilation import compile_model
+from frontend import LFCCFrontend
 from logger import setup_logger
+from metrics import MetricsAccumulator, log_odds
 from model import LCNN
-from sklearn.metrics import roc_curve
+from precision import autocast
+from score_cache import content_hash, open_score_cache
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
@@ -13,89 +20,274 @@ config = Config()
 logger = setup_logger("inference", log_file=f"{config.logs_path}/inference.log")
 
 
-# Metrics:
-def compute_accuracy(predictions, targets):
-    correct = (predictions == targets).sum()
-    total = len(targets)
-    accuracy = 100 * correct / total
-    return accuracy
+def backend_path(model_path, backend):
+    """File `export.py` writes for `backend` next to the fp32 checkpoint."""
+    model_path = Path(model_path)
+    if backend == "int8":
+        return model_path.with_name(f"{model_path.stem}_int8.pt")
+    if backend == "onnx":
+        return model_path.with_suffix(".onnx")
+    return model_path
 
 
-def compute_eer(scores, targets):
-    fpr, tpr, thresholds = roc_curve(targets, scores, pos_label=1)
-    fnr = 1 - tpr
-    # Find the threshold where FPR and FNR are closest (EER point)
+class OnnxModel:
+    """onnxruntime session called like the torch model (tensor in, logits out)."""
 
-    eer_idx = np.nanargmin(np.abs(fpr - fnr))
-    eer = (fpr[eer_idx] + fnr[eer_idx]) / 2
-    threshold = thresholds[eer_idx]
+    def __init__(self, path):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                "The onnx backend needs onnxruntime: pip install onnxruntime"
+            ) from e
+        self.session = onnxruntime.InferenceSession(
+            str(path), providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
 
-    return eer, threshold
+    def __call__(self, inputs):
+        features = inputs.detach().float().cpu().numpy()
+        logits = self.session.run(None, {self.input_name: features})[0]
+        return torch.from_numpy(logits).to(inputs.device)
 
+    def eval(self):
+        return self
 
-def run_inference(audio_list, model_path, config):
-    dataset = AudioDataset(audio_list=audio_list, config=config)
 
-    dataloader = DataLoader(
-        dataset,
-        batch_size=config.batch_size,
-        num_workers=config.num_workers,
-        shuffle=False,
-    )
+def load_model(model_path, config):
+    """LCNN in eval mode with the weights at `model_path` (if given), laid out
+    and compiled as `config` asks. `config.inference_backend` "int8"/"onnx"
+    loads the matching `export.py` artifact instead."""
+    if config.inference_backend == "int8":
+        if config.device.type != "cpu":
+            raise ValueError("The int8 backend runs on CPU only")
+        path = backend_path(model_path, "int8")
+        # TorchScript module written by export.py, not a state dict
+        model = torch.jit.load(path, map_location="cpu")
+        logger.info(f"Loaded int8 model from {path}")
+        return model.eval()
+    if config.inference_backend == "onnx":
+        path = backend_path(model_path, "onnx")
+        logger.info(f"Loaded ONNX model from {path}")
+        return OnnxModel(path)
+    if config.inference_backend != "eager":
+        raise ValueError(f"Unsupported inference_backend: {config.inference_backend}")
 
-    # Load model
     model = LCNN(
         sample_rate=config.sr,
         n_lfcc=config.n_lfcc,
         n_fft=config.n_fft,
         hop_length=config.hop_length,
+        chunk_length=config.chunk_length,
     ).to(config.device)
     if model_path:
         model.load_state_dict(torch.load(model_path, map_location=config.device))
         logger.info(f"Loaded model from {model_path}")
     model.eval()
+    if config.channels_last:
+        model.network.to(memory_format=torch.channels_last)
+    if config.compile:
+        warmup_seconds = compile_model(model, config)
+        logger.info(f"Compiled model ({config.compile_mode}) in {warmup_seconds:.1f}s")
+    return model
+
+
+def logits_from_log_odds(values, config):
+    """Two-class logits with spoof log-odds `values`, as MetricsAccumulator
+    scores them."""
+    logits = torch.zeros(len(values), 2)
+    logits[:, config.class2idx["spoof"]] = values
+    return logits
+
+
+def _score_chunks(
+    audio_list, model_path, config, store_name, metrics, cache, audio_hashes
+):
+    """Run every chunk of `audio_list` through the model into `metrics`, and
+    store each file's chunk log-odds in `cache` (under `audio_hashes`) when
+    there is one. Returns (dataset, chunks scored, model seconds)."""
+    store_kwargs = {}
+    if config.data_mode == "pcm":
+        store_kwargs["pcm_store"] = build_pcm_store(audio_list, config, name=store_name)
+    elif config.data_mode == "lfcc":
+        store_kwargs["lfcc_store"] = build_lfcc_store(
+            audio_list, config, name=store_name
+        )
+    dataset = AudioDataset(audio_list=audio_list, config=config, **store_kwargs)
+    silence = dataset.silence_report()
+    if silence is not None:
+        # Loss weights only matter in training; "weight" scores every chunk
+        logger.info(
+            f"Silence - {silence['low_speech']}/{silence['chunks']} chunks below "
+            f"speech ratio {config.min_speech_ratio}, {silence['dropped']} not scored "
+            f"({silence['saved']:.1%} of LFCC and model compute saved)"
+        )
+
+    dataloader = DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+        shuffle=False,
+    )
+
+    # Load model
+    model = load_model(model_path, config)
 
-    all_predictions = []
-    all_targets = []
-    all_scores = []
+    frontend = None
+    if dataset.return_waveform:
+        frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+
+    model_seconds = 0.0
+    num_scored = 0
+    chunk_log_odds = []
     with torch.no_grad():
         for inputs, targets in tqdm(dataloader, desc="Evaluating"):
             inputs = inputs.to(config.device)
+            if frontend is not None:
+                inputs = to_model_layout(frontend(inputs))
+            if config.channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
             targets = targets.to(config.device).long()
 
-            outputs = model(inputs)
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            # Probabilities of spoof class
-            spoof_scores = probabilities[:, config.class2idx["spoof"]]
-            _, predicted = torch.max(outputs, 1)
-            all_predictions.extend(predicted.cpu().tolist())
-            all_targets.extend(targets.cpu().tolist())
-            all_scores.extend(spoof_scores.cpu().tolist())
+            if config.device.type == "cuda":
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            with autocast(config):
+                outputs = model(inputs)
+            outputs = outputs.float()
+            if config.device.type == "cuda":
+                torch.cuda.synchronize()
+            model_seconds += time.perf_counter() - start_time
+            num_scored += len(outputs)
+            metrics.update(outputs, targets)
+            if cache is not None:
+                chunk_log_odds.append(
+                    log_odds(outputs, config.class2idx["spoof"]).cpu()
+                )
+
+    if cache is not None:
+        # chunk_index lists each file's chunks together, in file order
+        all_log_odds = torch.cat(chunk_log_odds) if chunk_log_odds else torch.zeros(0)
+        start = 0
+        chunk_files = (file_path for file_path, _, _ in dataset.chunk_index)
+        for file_path, chunks in itertools.groupby(chunk_files):
+            num_chunks = len(list(chunks))
+            cache.put(
+                audio_hashes[file_path],
+                all_log_odds[start : start + num_chunks].numpy(),
+            )
+            start += num_chunks
+    return dataset, num_scored, model_seconds
+
+
+def run_inference(audio_list, model_path, config, store_name="eval"):
+    metrics = MetricsAccumulator(
+        positive_class=config.class2idx["spoof"],
+        num_bins=config.metric_bins,
+        exact=config.exact_metrics,
+        device=config.device,
+    )
+
+    # Files already scored with the same audio bytes, weights and features
+    # come from the score cache and skip decode, LFCC and the model
+    model_file = model_path and backend_path(model_path, config.inference_backend)
+    cache = open_score_cache(model_file, config)
+    audio_hashes = {}
+    if cache is not None:
+        to_score = []
+        for file_path, label in audio_list:
+            audio_hash = content_hash(file_path)
+            hit = cache.get(audio_hash)
+            if hit is None:
+                audio_hashes[file_path] = audio_hash
+                to_score.append((file_path, label))
+                continue
+            cached_log_odds = torch.from_numpy(hit[0])
+            targets = torch.full((len(cached_log_odds),), config.class2idx[label])
+            metrics.update(
+                logits_from_log_odds(cached_log_odds, config).to(config.device),
+                targets.to(config.device),
+            )
+        audio_list = to_score
+
+    # Nothing to decode or load when every file came from the cache
+    dataset = None
+    num_scored, model_seconds = 0, 0.0
+    if audio_list:
+        dataset, num_scored, model_seconds = _score_chunks(
+            audio_list, model_path, config, store_name, metrics, cache, audio_hashes
+        )
+
+    if cache is not None:
+        report = cache.report()
+        cache.close()
+        logger.info(
+            f"Score cache - {report['hits']}/{report['hits'] + report['misses']} "
+            f"files from the cache, {report['entries']} entries, "
+            f"{report['size_mb']:.1f} MB"
+        )
 
-    all_predictions = np.array(all_predictions)
-    all_targets = np.array(all_targets)
-    all_scores = np.array(all_scores)
+    results = metrics.compute()
+    accuracy, eer = results["accuracy"], results["eer"]
+    throughput = None
+    speed = "no chunks run through the model"
+    if num_scored:
+        throughput = num_scored / max(model_seconds, 1e-9)
+        speed = f"Model throughput: {throughput:.1f} chunks/s"
+    logger.info(
+        f"Accuracy: {accuracy:.2f}%%, EER: {eer:.4f}, {speed} "
+        f"({config.inference_backend}, {config.precision})"
+    )
+    if config.audio_cache_mb > 0 and dataset is not None:
+        cache = dataset.cache_report()
+        logger.info(
+            f"Audio cache - Hit rate: {cache['hit_rate']:.1%}, "
+            f"Decodes: {cache['decodes']}, Memory: {cache['cache_mb']:.1f} MB"
+        )
+    return {"accuracy": accuracy, "eer": eer, "throughput": throughput}
 
-    accuracy = compute_accuracy(all_predictions, all_targets)
-    eer, eer_threshold = compute_eer(all_scores, all_targets)
 
-    logger.info(f"Accuracy: {accuracy:.2f}%%, EER: {eer:.4f}")
+def compare_precision(audio_list, model_path, config, store_name="eval"):
+    """Score with fp32 and with `config.precision` and report the throughput
+    gain and the EER difference of the reduced precision mode. Bypasses the
+    score cache, which would skip the model runs being timed."""
+    config = replace(config, score_cache_path=None)
+    baseline = run_inference(
+        audio_list,
+        model_path,
+        replace(config, precision="fp32", channels_last=False),
+        store_name,
+    )
+    reduced = run_inference(audio_list, model_path, config, store_name)
+    logger.info(
+        f"{config.precision} vs fp32 - "
+        f"Speedup: {reduced['throughput'] / baseline['throughput']:.2f}x, "
+        f"EER difference: {reduced['eer'] - baseline['eer']:+.4f}, "
+        f"Accuracy difference: {reduced['accuracy'] - baseline['accuracy']:+.2f}"
+    )
+    return baseline, reduced
 
 
 if __name__ == "__main__":
     # Example usage
-    audios_list = []
-    with open(
-        Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.eval.trl.txt"), "r"
-    ) as f:
-        lines = f.readlines()
-        for line in lines:
-            words = line.strip().split()
-            audio_filename = words[1] + ".flac"
-            label = words[-1]
-            full_path = Path("../PA/ASVspoof2019_PA_eval/flac") / audio_filename
-            audios_list.append((str(full_path), label))
-
-    run_inference(
-        audios_list, model_path=config.save_path + "/best_model.pth", config=config
+    audios_list = list(
+        iter_protocol(
+            Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.eval.trl.txt"),
+            Path("../PA/ASVspoof2019_PA_eval/flac"),
+        )
     )
+
+    if config.precision != "fp32" or config.channels_last:
+        compare_precision(
+            audios_list, model_path=config.save_path + "/best_model.pth", config=config
+        )
+    else:
+        run_inference(
+            audios_list, model_path=config.save_path + "/best_model.pth", config=config
+        )
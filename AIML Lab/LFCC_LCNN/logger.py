@@ -3,15 +3,19 @@ import sys
 from pathlib import Path
 
 
-def setup_logger(name: str, log_file: str | None = None, level=logging.INFO):
-    """Setup logger with console and optional file output."""
+def setup_logger(
+    name: str, log_file: str | None = None, level=logging.INFO, rank: int = 0
+):
+    """Setup logger with console and optional file output.
+    In distributed runs only rank 0 logs INFO and writes the log file; other
+    ranks print warnings and errors only."""
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
     logger = logging.getLogger(name)
-    logger.setLevel(level)
+    logger.setLevel(level if rank == 0 else max(level, logging.WARNING))
 
     # Avoid adding duplicate handlers if logger already exists
     if logger.handlers:
@@ -23,7 +27,7 @@ def setup_logger(name: str, log_file: str | None = None, level=logging.INFO):
     logger.addHandler(console_handler)
 
     # File handler (optional)
-    if log_file:
+    if log_file and rank == 0:
         Path(log_file).parent.mkdir(parents=True, exist_ok=True)
         file_handler = logging.FileHandler(log_file)
         file_handler.setFormatter(formatter)
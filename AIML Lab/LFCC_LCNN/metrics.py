@@ -0,0 +1,172 @@
+import torch
+import torch.distributed as dist
+
+
+def log_odds(outputs, positive_class=1):
+    """log(p / (1 - p)) of `positive_class`, from (batch, num_classes) logits."""
+    others = torch.ones(outputs.size(1), dtype=torch.bool, device=outputs.device)
+    others[positive_class] = False
+    margin = outputs[:, positive_class] - torch.logsumexp(outputs[:, others], dim=1)
+    return torch.nan_to_num(margin)
+
+
+def _eer_from_counts(negative_counts, positive_counts):
+    """EER from per-bin class counts in ascending score order.
+    Threshold k accepts bins k and above as positive (k == num_bins rejects
+    everything). Returns (eer, k) at the point where FPR and FNR are closest.
+    """
+    num_negative = negative_counts.sum()
+    num_positive = positive_counts.sum()
+    if num_negative == 0 or num_positive == 0:
+        return float("nan"), 0
+    zero = positive_counts.new_zeros(1)
+    fnr = torch.cat([zero, positive_counts.cumsum(0)]).double() / num_positive
+    fpr = 1 - torch.cat([zero, negative_counts.cumsum(0)]).double() / num_negative
+    idx = int(torch.argmin((fpr - fnr).abs()))
+    return float((fpr[idx] + fnr[idx]) / 2), idx
+
+
+def compute_eer(scores, targets, positive_label=1):
+    """Exact EER over every distinct score, like sklearn's roc_curve.
+    Returns (eer, threshold); scores at or above the threshold count as positive.
+    """
+    scores = torch.as_tensor(scores).flatten().double()
+    positive = (torch.as_tensor(targets).flatten() == positive_label).long()
+    thresholds, bins = torch.unique(scores, sorted=True, return_inverse=True)
+    counts = torch.bincount(
+        bins + positive.to(bins.device) * len(thresholds),
+        minlength=2 * len(thresholds),
+    ).view(2, -1)
+    eer, idx = _eer_from_counts(counts[0], counts[1])
+    threshold = float(thresholds[idx]) if idx < len(thresholds) else float("inf")
+    return eer, threshold
+
+
+class MetricsAccumulator:
+    """Streaming loss, accuracy and EER kept on the model's device.
+    Each chunk is scored by its positive-class log-odds (monotonic in the
+    softmax probability, but without saturating at 0/1) and counted into a
+    fixed (2, num_bins) histogram over [-margin_range, margin_range], so
+    memory stays constant and nothing is copied to the host until `compute`.
+    With `exact=True` the margins are kept instead and the EER is exact.
+    """
+
+    def __init__(
+        self,
+        positive_class=1,
+        num_bins=10000,
+        margin_range=20.0,
+        exact=False,
+        device="cpu",
+    ):
+        self.positive_class = positive_class
+        self.num_bins = num_bins
+        self.margin_range = margin_range
+        self.exact = exact
+        self.device = device
+        self.reset()
+
+    def reset(self):
+        self.histogram = torch.zeros(
+            2, self.num_bins, dtype=torch.long, device=self.device
+        )
+        self.correct = torch.zeros((), dtype=torch.long, device=self.device)
+        self.loss_sum = torch.zeros((), dtype=torch.float64, device=self.device)
+        self.num_samples = 0
+        self.num_batches = 0
+        self.margins = []
+        self.labels = []
+
+    def state_dict(self):
+        return {
+            "histogram": self.histogram,
+            "correct": self.correct,
+            "loss_sum": self.loss_sum,
+            "num_samples": self.num_samples,
+            "num_batches": self.num_batches,
+            "margins": self.margins,
+            "labels": self.labels,
+        }
+
+    def load_state_dict(self, state):
+        self.histogram = state["histogram"].to(self.device)
+        self.correct = state["correct"].to(self.device)
+        self.loss_sum = state["loss_sum"].to(self.device)
+        self.num_samples = state["num_samples"]
+        self.num_batches = state["num_batches"]
+        self.margins = [margin.to(self.device) for margin in state["margins"]]
+        self.labels = [label.to(self.device) for label in state["labels"]]
+
+    def score_margin(self, outputs):
+        return log_odds(outputs, self.positive_class)
+
+    def add_loss(self, loss):
+        self.loss_sum += loss.detach()
+        self.num_batches += 1
+
+    def update(self, outputs, targets, loss=None):
+        outputs = outputs.detach().float()
+        if loss is not None:
+            self.add_loss(loss)
+        self.correct += (outputs.argmax(dim=1) == targets).sum()
+        self.num_samples += targets.numel()
+
+        margin = self.score_margin(outputs)
+        positive = (targets == self.positive_class).long()
+        if self.exact:
+            self.margins.append(margin)
+            self.labels.append(positive)
+            return
+        scale = self.num_bins / (2 * self.margin_range)
+        bins = ((margin + self.margin_range) * scale).floor().long()
+        bins = bins.clamp(0, self.num_bins - 1)
+        self.histogram += torch.bincount(
+            bins + positive * self.num_bins, minlength=2 * self.num_bins
+        ).view(2, -1)
+
+    def all_reduce(self):
+        """Sum the counts of all ranks into every rank's accumulator.
+        Must be called on every rank (before `compute`); no-op without a
+        process group."""
+        if not (dist.is_available() and dist.is_initialized()):
+            return
+        counts = torch.tensor(
+            [self.num_samples, self.num_batches], dtype=torch.long, device=self.device
+        )
+        for tensor in (self.histogram, self.correct, self.loss_sum, counts):
+            dist.all_reduce(tensor)
+        self.num_samples, self.num_batches = counts.tolist()
+        if self.exact:
+            local = (
+                torch.cat(self.margins).cpu() if self.margins else torch.zeros(0),
+                torch.cat(self.labels).cpu() if self.labels else torch.zeros(0),
+            )
+            gathered = [None] * dist.get_world_size()
+            dist.all_gather_object(gathered, local)
+            self.margins = [margins.to(self.device) for margins, _ in gathered]
+            self.labels = [labels.to(self.device) for _, labels in gathered]
+
+    def compute(self):
+        """Returns loss (mean over batches), accuracy (%), EER and the EER
+        threshold as a positive-class probability."""
+        if self.exact:
+            margins = torch.cat(self.margins) if self.margins else torch.zeros(0)
+            labels = torch.cat(self.labels) if self.labels else torch.zeros(0)
+            eer, threshold = compute_eer(margins.cpu(), labels.cpu())
+        else:
+            histogram = self.histogram.cpu()
+            eer, idx = _eer_from_counts(histogram[0], histogram[1])
+            bin_width = 2 * self.margin_range / self.num_bins
+            threshold = -self.margin_range + idx * bin_width
+            if idx == 0:
+                threshold = float("-inf")
+            elif idx == self.num_bins:
+                threshold = float("inf")
+        threshold = float(torch.sigmoid(torch.tensor(threshold)))
+
+        return {
+            "loss": float(self.loss_sum) / max(self.num_batches, 1),
+            "accuracy": 100 * float(self.correct) / max(self.num_samples, 1),
+            "eer": eer,
+            "threshold": threshold,
+        }
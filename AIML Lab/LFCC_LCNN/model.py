@@ -10,27 +10,18 @@ class MaxFeatureMap2D(nn.Module):
 
     def __init__(self, max_dim=1):
         super(MaxFeatureMap2D, self).__init__()
+        if not -4 <= max_dim < 4:
+            raise ValueError("Invalid max_dim for MaxFeatureMap")
         self.max_dim = max_dim
 
     def forward(self, inputs):
-        shape = list(inputs.size())
-        if self.max_dim >= len(shape):
-            print("MaxFeatureMap: maximize on %d dim" % (self.max_dim))
-            print("But input has %d dimensions" % (len(shape)))
-            raise ValueError("Invalid max_dim for MaxFeatureMap")
-        if shape[self.max_dim] // 2 * 2 != shape[self.max_dim]:
-            print("MaxFeatureMap: maximize on %d dim" % (self.max_dim))
-            print("But this dimension has an odd number of data")
-            raise ValueError("Dimension to maximize must have even size")
-
-        shape[self.max_dim] = shape[self.max_dim] // 2
-        shape.insert(self.max_dim, 2)
-        output = inputs.view(*shape).max(self.max_dim)[0]
-        return output
+        # Channel pairs are (c, c + channels//2); LCNN checks for an even
+        # channel count when the network is built.
+        return inputs.unflatten(self.max_dim, (2, -1)).max(self.max_dim).values
 
 
 class LCNN(nn.Module):
-    def __init__(self, sample_rate, n_lfcc, n_fft, hop_length):
+    def __init__(self, sample_rate, n_lfcc, n_fft, hop_length, chunk_length=2):
         super(LCNN, self).__init__()
 
         # Actual LCNN network
@@ -108,10 +99,28 @@ class LCNN(nn.Module):
             nn.Dropout(0.8),
         )
 
+        # Shape checks run once here instead of on every forward
+        channels = 1
+        for layer in self.network:
+            if isinstance(layer, nn.Conv2d):
+                channels = layer.out_channels
+            elif isinstance(layer, MaxFeatureMap2D):
+                if channels % 2 != 0:
+                    raise ValueError("Dimension to maximize must have even size")
+                channels //= 2
+
+        # Each of the four 2x2 max pools halves (and floors) both axes
+        time_frames = int(chunk_length * sample_rate) // hop_length + 1
+        in_features = channels * (n_lfcc // 16) * (time_frames // 16)
+        if in_features == 0:
+            raise ValueError(
+                f"Input of {n_lfcc} x {time_frames} is too small for four 2x2 pools"
+            )
+
         # Final fully connected layer for binary classification
         self.fc = nn.Sequential(
             nn.Flatten(),
-            nn.LazyLinear(out_features=64),
+            nn.Linear(in_features, out_features=64),
             nn.ReLU(),
             nn.Dropout(0.7),
             nn.Linear(64, 2),
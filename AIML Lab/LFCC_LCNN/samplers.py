@@ -0,0 +1,173 @@
+import itertools
+
+import torch
+from torch.utils.data import Sampler
+
+
+class EpochRandomSampler(Sampler):
+    """Random permutation seeded by `seed + epoch`, so the order of an epoch
+    can be regenerated when resuming. `set_epoch(epoch, start)` skips the
+    first `start` indices of that epoch.
+    """
+
+    def __init__(self, num_samples, seed=0):
+        self.num_samples = num_samples
+        self.seed = seed
+        self.epoch = 0
+        self.start = 0
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_samples, generator=generator)
+        yield from order[self.start :].tolist()
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+
+class FileGroupSampler(Sampler):
+    """Shuffles at file-group granularity.
+    Every epoch the files are shuffled and cut into groups of `files_per_group`;
+    the groups are emitted one after another with their chunks shuffled inside
+    the group. Consecutive indices therefore come from a handful of files, so a
+    DataLoader batch (which goes to a single worker) mostly reuses audio that
+    worker has already decoded. With `num_replicas > 1` every rank takes every
+    `num_replicas`-th index of that order (padded to equal length, like
+    DistributedSampler), which keeps the locality on each rank.
+    """
+
+    def __init__(self, chunk_index, files_per_group, seed=0, num_replicas=1, rank=0):
+        self.files_per_group = files_per_group
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.start = 0
+
+        chunks_per_file = {}
+        for idx, (file_path, _, _) in enumerate(chunk_index):
+            chunks_per_file.setdefault(file_path, []).append(idx)
+        self.file_chunks = list(chunks_per_file.values())
+        self.num_samples = -(-len(chunk_index) // num_replicas)
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+
+    def __iter__(self):
+        indices = self._indices()
+        if self.num_replicas > 1:
+            indices = list(indices)
+            indices += indices[: self.num_samples * self.num_replicas - len(indices)]
+            indices = indices[self.rank :: self.num_replicas]
+        return itertools.islice(indices, self.start, None)
+
+    def _indices(self):
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        file_order = torch.randperm(len(self.file_chunks), generator=generator)
+        for start in range(0, len(file_order), self.files_per_group):
+            group = [
+                idx
+                for file_idx in file_order[start : start + self.files_per_group]
+                for idx in self.file_chunks[file_idx]
+            ]
+            for pos in torch.randperm(len(group), generator=generator).tolist():
+                yield group[pos]
+
+    def __len__(self):
+        return self.num_samples - self.start
+
+
+class ImportanceSampler(Sampler):
+    """Draws chunks in proportion to their recent training loss.
+
+    `update(indices, losses)` folds per-chunk losses into an exponential
+    moving average (weight `smoothing` on the previous value); chunks not
+    seen yet count with the mean loss of those seen. At every `set_epoch` the draw
+    probabilities are fixed for the epoch as a mix of the normalized losses
+    and a uniform `floor` share, p_i = (1 - floor) * l_i / sum(l) + floor / N,
+    and `fraction * N` chunks are drawn with replacement (seeded by
+    `seed + epoch`). Scaling each drawn chunk's loss by its `weights` entry,
+    1 / (N * p_i) (at most 1 / floor), keeps the expected gradient equal to
+    that of uniform sampling.
+
+    Batches are consecutive slices of the draw order, so `batch_indices(step,
+    batch_size)` gives the chunk indices of a DataLoader batch without the
+    dataset returning them. `set_epoch(epoch, start)` with `start > 0`
+    resumes inside an epoch and keeps the probabilities restored by
+    `load_state_dict`.
+    """
+
+    def __init__(
+        self,
+        num_samples,
+        fraction=0.5,
+        floor=0.2,
+        smoothing=0.5,
+        seed=0,
+    ):
+        self.num_samples = num_samples
+        self.num_draws = max(1, round(fraction * num_samples))
+        self.floor = floor
+        self.smoothing = smoothing
+        self.seed = seed
+        self.losses = torch.zeros(num_samples)
+        self.seen = torch.zeros(num_samples, dtype=torch.bool)
+        self.epoch = 0
+        self.start = 0
+        self.probabilities = None
+        self.set_epoch(0)
+
+    def set_epoch(self, epoch, start=0):
+        self.epoch = epoch
+        self.start = start
+        if start == 0 or self.probabilities is None:
+            losses = self.losses.clamp(min=0)
+            if self.seen.any():
+                losses = torch.where(self.seen, losses, losses[self.seen].mean())
+            uniform = torch.full_like(losses, 1 / self.num_samples)
+            if losses.sum() > 0:
+                self.probabilities = (1 - self.floor) * losses / losses.sum()
+                self.probabilities += self.floor * uniform
+            else:
+                self.probabilities = uniform
+        generator = torch.Generator().manual_seed(self.seed + self.epoch)
+        self.draws = torch.multinomial(
+            self.probabilities, self.num_draws, replacement=True, generator=generator
+        )
+        self.weights = 1 / (self.num_samples * self.probabilities)
+
+    def update(self, indices, losses):
+        """Fold the per-sample `losses` of the chunks at `indices` into their
+        running loss. A chunk drawn twice in a batch keeps one of its values."""
+        indices = torch.as_tensor(indices).cpu()
+        losses = losses.detach().float().cpu()
+        smoothed = self.smoothing * self.losses[indices] + (1 - self.smoothing) * losses
+        self.losses[indices] = torch.where(self.seen[indices], smoothed, losses)
+        self.seen[indices] = True
+
+    def batch_indices(self, step, batch_size):
+        """Chunk indices of batch `step` of this epoch (counted from its start)."""
+        return self.draws[step * batch_size : (step + 1) * batch_size]
+
+    def state_dict(self):
+        return {
+            "losses": self.losses,
+            "seen": self.seen,
+            "probabilities": self.probabilities,
+        }
+
+    def load_state_dict(self, state):
+        self.losses = state["losses"]
+        self.seen = state["seen"]
+        self.probabilities = state["probabilities"]
+
+    def __iter__(self):
+        yield from self.draws[self.start :].tolist()
+
+    def __len__(self):
+        return self.num_draws - self.start
@@ -0,0 +1,169 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+# Config fields that change the chunk scores of a given checkpoint
+CACHE_FIELDS = (
+    "sr",
+    "chunk_length",
+    "chunk_overlap",
+    "n_lfcc",
+    "n_fft",
+    "hop_length",
+    "fused_frontend",
+    "data_mode",  # the LFCC store pads the last frames differently
+    "pcm_dtype",  # an int16 PCM store quantizes the audio
+    "min_speech_ratio",
+    "silence_policy",
+    "vad_threshold_db",
+    "inference_backend",
+    "precision",
+)
+
+
+def content_hash(source):
+    """sha256 hex digest of raw audio bytes, or of the file at path `source`."""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        digest.update(source)
+    else:
+        with open(source, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_namespace(model_file, config):
+    """Key prefix for the weights in `model_file` under the CACHE_FIELDS of
+    `config`; anything that changes either gets fresh entries."""
+    digest = hashlib.sha256(content_hash(model_file).encode())
+    for name in CACHE_FIELDS:
+        digest.update(f"|{name}={getattr(config, name)}".encode())
+    return digest.hexdigest()
+
+
+class ScoreCache:
+    """Persistent sqlite store of scores keyed by audio content.
+
+    An entry holds the spoof log-odds of every chunk of one file and its
+    utterance score (mean chunk spoof probability), under the sha256 of the
+    file's bytes and `namespace` (see `cache_namespace`). Lookups refresh an
+    entry's last-use time, and once the entries pass `max_mb` the least
+    recently used ones are deleted. Safe to share between threads; several
+    processes may use the same file (sqlite WAL).
+    """
+
+    def __init__(self, path, namespace, max_mb=1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.namespace = namespace
+        self.max_bytes = max_mb * 2**20
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        with self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS scores ("
+                "key TEXT PRIMARY KEY, log_odds BLOB NOT NULL, score REAL, "
+                "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)"
+            )
+        self._total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self):
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM scores"
+        ).fetchone()[0]
+
+    def _key(self, audio_hash):
+        return hashlib.sha256(f"{self.namespace}:{audio_hash}".encode()).hexdigest()
+
+    def get(self, audio_hash):
+        """(per-chunk spoof log-odds as float32, utterance score) for the
+        audio with content hash `audio_hash`, or None."""
+        key = self._key(audio_hash)
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT log_odds, score FROM scores WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE scores SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+        log_odds, score = row
+        return np.frombuffer(log_odds, dtype=np.float32).copy(), score
+
+    def put(self, audio_hash, log_odds):
+        """Store the per-chunk spoof log-odds of one file; returns its
+        utterance score."""
+        log_odds = np.asarray(log_odds, dtype=np.float32)
+        score = None
+        if len(log_odds):
+            score = float(np.mean(1 / (1 + np.exp(-log_odds.astype(np.float64)))))
+        key = self._key(audio_hash)
+        blob = log_odds.tobytes()
+        size = len(blob) + len(key) + 64  # rough row overhead
+        with self._lock, self._conn:
+            old = self._conn.execute(
+                "SELECT size FROM scores WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)",
+                (key, blob, score, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+        return score
+
+    def _evict(self):
+        # Other processes may have written too, so start from the real total
+        self._total_bytes = self._stored_bytes()
+        while self._total_bytes > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM scores ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM scores WHERE key = ?", (key,))
+                self._total_bytes -= size
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def report(self):
+        """Hits, misses and size of the cache so far."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": entries,
+                "size_mb": self._total_bytes / 2**20,
+            }
+
+    def close(self):
+        self._conn.close()
+
+
+def open_score_cache(model_file, config):
+    """ScoreCache at `config.score_cache_path` for the weights in
+    `model_file`, or None if the cache is disabled or there is no file."""
+    if config.score_cache_path is None or not model_file:
+        return None
+    return ScoreCache(
+        config.score_cache_path,
+        cache_namespace(model_file, config),
+        max_mb=config.score_cache_mb,
+    )
@@ -0,0 +1,286 @@
+import io
+import json
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from audio_dataset import Config, load_audio, split_chunks, to_model_layout
+from frontend import LFCCFrontend
+from inference import backend_path, load_model
+from logger import setup_logger
+from metrics import log_odds
+from precision import autocast
+from score_cache import content_hash, open_score_cache
+
+logger = setup_logger("server")
+
+
+class ScoreRequest:
+    """Chunks of one utterance waiting for the batcher."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.scores = torch.empty(len(chunks))
+        self.next_chunk = 0  # first chunk not yet put into a batch
+        self.num_scored = 0
+        self.arrival = time.monotonic()
+        self.error = None
+        self.done = threading.Event()
+
+
+class DynamicBatcher:
+    """Pools the chunks of concurrent requests into batches for one model.
+    A batch runs as soon as it holds `max_batch_size` chunks or its oldest
+    chunk has waited `max_wait_ms`, so a lone request is delayed by at most
+    `max_wait_ms`. Long utterances are split over consecutive batches.
+    Only the batching thread touches the model.
+    """
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+        self.max_batch_size = config.max_batch_size
+        self.max_wait = config.max_wait_ms / 1000
+        self.spoof_idx = config.class2idx["spoof"]
+        self.frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+
+        self._pending = deque()
+        self._pending_chunks = 0
+        self._cond = threading.Condition()
+        self.num_requests = 0
+        self.batch_sizes = Counter()
+        # Pending chunks each time a batch is cut, in power-of-two buckets
+        self.queue_depths = Counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def score(self, chunks):
+        """Spoof log-odds of every chunk in `chunks` (num_chunks, samples).
+        Blocks until the last of them has been through the model."""
+        request = ScoreRequest(chunks)
+        if len(chunks) == 0:
+            return request.scores
+        with self._cond:
+            self._pending.append(request)
+            self._pending_chunks += len(chunks)
+            self.num_requests += 1
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.scores
+
+    def _next_batch(self):
+        """Wait for a full batch or the oldest chunk's deadline, then cut the
+        batch as (request, start, end) chunk ranges."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0].arrival + self.max_wait
+            while self._pending_chunks < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            self.queue_depths[1 << (self._pending_chunks - 1).bit_length()] += 1
+            parts = []
+            batch_size = 0
+            while self._pending and batch_size < self.max_batch_size:
+                request = self._pending[0]
+                start = request.next_chunk
+                end = min(len(request.chunks), start + self.max_batch_size - batch_size)
+                parts.append((request, start, end))
+                request.next_chunk = end
+                batch_size += end - start
+                if end == len(request.chunks):
+                    self._pending.popleft()
+            self._pending_chunks -= batch_size
+            self.batch_sizes[batch_size] += 1
+            return parts
+
+    def _forward(self, waveforms):
+        with torch.no_grad():
+            inputs = to_model_layout(self.frontend(waveforms.to(self.config.device)))
+            if getattr(self.config, "channels_last", False):
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+            with autocast(self.config):
+                outputs = self.model(inputs)
+        return log_odds(outputs.float(), self.spoof_idx).cpu()
+
+    def _run(self):
+        while True:
+            parts = self._next_batch()
+            try:
+                scores = self._forward(
+                    torch.cat(
+                        [request.chunks[start:end] for request, start, end in parts]
+                    )
+                )
+            except Exception as e:
+                logger.exception("Batch failed")
+                with self._cond:
+                    for request, _, _ in parts:
+                        if request in self._pending:
+                            self._pending.remove(request)
+                            self._pending_chunks -= (
+                                len(request.chunks) - request.next_chunk
+                            )
+                        request.error = e
+                        request.done.set()
+                continue
+
+            offset = 0
+            for request, start, end in parts:
+                request.scores[start:end] = scores[offset : offset + end - start]
+                offset += end - start
+                request.num_scored += end - start
+                if request.num_scored == len(request.chunks):
+                    request.done.set()
+
+    def stats(self):
+        with self._cond:
+            num_batches = sum(self.batch_sizes.values())
+            num_chunks = sum(size * n for size, n in self.batch_sizes.items())
+            return {
+                "queue_depth": {
+                    "requests": len(self._pending),
+                    "chunks": self._pending_chunks,
+                },
+                "requests": self.num_requests,
+                "batches": num_batches,
+                "mean_batch_size": num_chunks / max(num_batches, 1),
+                "batch_size_histogram": dict(sorted(self.batch_sizes.items())),
+                "queue_depth_histogram": {
+                    f"<={depth}": n for depth, n in sorted(self.queue_depths.items())
+                },
+            }
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """POST /score with raw audio bytes, or with a JSON body {"path": ...}
+    for a file the server can read. GET /stats and GET /health. With a score
+    cache, audio whose bytes were scored before is answered from it."""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            stats = self.server.batcher.stats()
+            if self.server.cache is not None:
+                stats["score_cache"] = self.server.cache.report()
+            self._send_json(200, stats)
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/score":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+        config = self.server.config
+        start_time = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        cache = self.server.cache
+        cached = None
+        try:
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                source = json.loads(body)["path"]
+                audio_hash = content_hash(source) if cache is not None else None
+            else:
+                source = io.BytesIO(body)
+                audio_hash = content_hash(body) if cache is not None else None
+            if cache is not None:
+                cached = cache.get(audio_hash)
+            if cached is None:
+                audio = torch.from_numpy(load_audio(source, config.sr))
+        except Exception as e:
+            self._send_json(400, {"error": f"Could not read audio: {e}"})
+            return
+        if cached is None and audio.dim() != 1:
+            # Would fail every request batched with it
+            self._send_json(
+                400, {"error": f"Expected 1D audio, got shape {tuple(audio.shape)}"}
+            )
+            return
+
+        if cached is not None:
+            chunk_log_odds = torch.from_numpy(cached[0])
+        else:
+            chunk_samples = int(config.chunk_length * config.sr)
+            step_samples = chunk_samples - int(config.chunk_overlap * config.sr)
+            chunks = split_chunks(audio, chunk_samples, step_samples)
+            try:
+                chunk_log_odds = self.server.batcher.score(chunks)
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            if cache is not None:
+                cache.put(audio_hash, chunk_log_odds.numpy())
+        chunk_scores = torch.sigmoid(chunk_log_odds)
+
+        # Utterance score: mean spoof probability over its chunks; audio
+        # shorter than one chunk has no score (NaN is not valid JSON)
+        score = label = None
+        if len(chunk_scores):
+            score = float(chunk_scores.mean())
+            label = "spoof" if score >= 0.5 else "bonafide"
+        self._send_json(
+            200,
+            {
+                "score": score,
+                "label": label,
+                "num_chunks": len(chunk_scores),
+                "chunk_scores": chunk_scores.tolist(),
+                "cached": cached is not None,
+                "latency_ms": 1000 * (time.perf_counter() - start_time),
+            },
+        )
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(model, config, model_path=None):
+    """Serve `model` until interrupted. `model_path` (the checkpoint it was
+    loaded from) enables the score cache when `score_cache_path` is set."""
+    server = ThreadingHTTPServer(
+        (config.server_host, config.server_port), ScoringHandler
+    )
+    server.daemon_threads = True
+    server.config = config
+    server.batcher = DynamicBatcher(model, config)
+    # Requests are decoded and cut into every chunk, without the stores or
+    # the VAD of AudioDataset
+    server.cache = open_score_cache(
+        model_path and backend_path(model_path, config.inference_backend),
+        replace(config, min_speech_ratio=0.0, data_mode="raw"),
+    )
+    logger.info(
+        f"Serving on http://{config.server_host}:{config.server_port} "
+        f"(max batch {config.max_batch_size}, max wait {config.max_wait_ms} ms)"
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    config = Config()
+    model_path = config.save_path + "/best_model.pth"
+    model = load_model(model_path, config)
+    serve(model, config, model_path)
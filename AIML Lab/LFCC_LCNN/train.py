@@ -1,79 +1,201 @@
+import itertools
+from contextlib import nullcontext
 from pathlib import Path
 
 import matplotlib.pyplot as plt
-import numpy as np
 import torch
-from audio_dataset import AudioDataset, Config
+from audio_dataset import (
+    AudioDataset,
+    Config,
+    StreamingAudioDataset,
+    iter_protocol,
+    to_model_layout,
+)
+from audio_store import build_lfcc_store, build_pcm_store
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, set_rng_state
+from compilation import compile_model
+from distributed import (
+    EvalShardSampler,
+    ResumableDistributedSampler,
+    broadcast_object,
+    cleanup_distributed,
+    init_distributed,
+    is_main_process,
+    main_process_first,
+)
+from frontend import LFCCFrontend
 from logger import setup_logger
+from metrics import MetricsAccumulator
 from model import LCNN
-from sklearn.metrics import roc_curve
+from precision import autocast, grad_scaler
+from profiling import StepProfiler, StepTimer
+from samplers import EpochRandomSampler, FileGroupSampler, ImportanceSampler
+from shards import ShardDataset
+from torch.nn.parallel import DistributedDataParallel
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 config = Config()
+rank, world_size = init_distributed(config)
 torch.manual_seed(config.seed)
-logger = setup_logger("train", log_file=f"{config.logs_path}/training.log")
+logger = setup_logger("train", log_file=f"{config.logs_path}/training.log", rank=rank)
 
 
 def add_from_file(filename, arr, audio_files_base_path):
-    with open(filename, "r") as f:
-        lines = f.readlines()
-        for line in lines:
-            words = line.strip().split()
-            audio_filename = words[1] + ".flac"
-            label = words[-1]
-            full_path = audio_files_base_path / audio_filename
-            arr.append((str(full_path), label))
+    arr.extend(iter_protocol(filename, audio_files_base_path))
     return arr
 
 
 # Dataset Preparation
-train = []
-eval = []
-train = add_from_file(
+train_protocol = (
     Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.train.trn2.txt"),
-    train,
     Path("../PA/ASVspoof2019_PA_train/flac"),
 )
-eval = add_from_file(
+eval_protocol = (
     Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.dev.trl2.txt"),
-    eval,
     Path("../PA/ASVspoof2019_PA_dev/flac"),
 )
 
-train_dataset = AudioDataset(audio_list=train, config=config)
-eval_dataset = AudioDataset(audio_list=eval, config=config)
-logger.info(
-    f"Number of Training samples: {len(train_dataset)} | "
-    f"Number of Evaluation samples: {len(eval_dataset)}"
-)
-
-
+# Rank 0 builds the index caches and stores first, the other ranks reuse them
+with main_process_first():
+    if config.data_mode == "stream":
+        train_dataset = StreamingAudioDataset([train_protocol], config, shuffle=True)
+        eval_dataset = StreamingAudioDataset([eval_protocol], config)
+        logger.info(
+            f"Streaming {train_dataset.num_entries()} training files | "
+            f"{eval_dataset.num_entries()} evaluation files"
+        )
+    elif config.data_mode == "shards":
+        train_dataset = ShardDataset(config, "train", shuffle=True)
+        eval_dataset = ShardDataset(config, "dev")
+        logger.info(
+            f"Number of Training samples: {train_dataset.expected_num_chunks()} | "
+            f"Number of Evaluation samples: {eval_dataset.expected_num_chunks()}"
+        )
+    else:
+        train = add_from_file(train_protocol[0], [], train_protocol[1])
+        eval = add_from_file(eval_protocol[0], [], eval_protocol[1])
+
+        store_kwargs = {"train": {}, "dev": {}}
+        if config.data_mode == "pcm":
+            store_kwargs["train"]["pcm_store"] = build_pcm_store(train, config, "train")
+            store_kwargs["dev"]["pcm_store"] = build_pcm_store(eval, config, "dev")
+        elif config.data_mode == "lfcc":
+            store_kwargs["train"]["lfcc_store"] = build_lfcc_store(
+                train, config, "train"
+            )
+            store_kwargs["dev"]["lfcc_store"] = build_lfcc_store(eval, config, "dev")
+
+        train_dataset = AudioDataset(
+            train,
+            config=config,
+            return_weight=config.silence_policy == "weight",
+            **store_kwargs["train"],
+        )
+        eval_dataset = AudioDataset(eval, config=config, **store_kwargs["dev"])
+        logger.info(
+            f"Number of Training samples: {len(train_dataset)} | "
+            f"Number of Evaluation samples: {len(eval_dataset)}"
+        )
+        for split, dataset in [("train", train_dataset), ("eval", eval_dataset)]:
+            silence = dataset.silence_report()
+            if silence is not None:
+                logger.info(
+                    f"Silence ({split}) - {silence['low_speech']}/{silence['chunks']} "
+                    f"chunks below speech ratio {config.min_speech_ratio}, "
+                    f"{silence['dropped']} dropped "
+                    f"({silence['saved']:.1%} of chunk compute saved)"
+                )
+
+
+# Seeded per-epoch samplers, so a resumed run can skip to its position
+train_sampler = None
+eval_sampler = None
+iterable_data = config.data_mode in ("stream", "shards")
+if config.importance_sampling and (
+    iterable_data or world_size > 1 or config.locality_group_size > 0
+):
+    raise ValueError(
+        "importance_sampling needs an indexed data_mode, a single process "
+        "and locality_group_size = 0"
+    )
+if config.importance_sampling:
+    train_sampler = ImportanceSampler(
+        len(train_dataset),
+        fraction=config.importance_fraction,
+        floor=config.importance_floor,
+        smoothing=config.importance_smoothing,
+        seed=config.seed,
+    )
+elif config.locality_group_size > 0 and not iterable_data:
+    train_sampler = FileGroupSampler(
+        train_dataset.chunk_index,
+        config.locality_group_size,
+        seed=config.seed,
+        num_replicas=world_size,
+        rank=rank,
+    )
+elif world_size > 1 and not iterable_data:
+    train_sampler = ResumableDistributedSampler(train_dataset, seed=config.seed)
+elif not iterable_data:
+    train_sampler = EpochRandomSampler(len(train_dataset), seed=config.seed)
+if world_size > 1 and not iterable_data:
+    eval_sampler = EvalShardSampler(len(eval_dataset), world_size, rank)
 train_dataloader = DataLoader(
     train_dataset,
     batch_size=config.batch_size,
     num_workers=config.num_workers,
     pin_memory=config.pin_memory,
-    shuffle=True,
+    sampler=train_sampler,
+    # Own generator: creating the iterator must not advance the global RNG,
+    # or dropout would diverge after a resume
+    generator=torch.Generator().manual_seed(config.seed),
 )
 eval_dataloader = DataLoader(
     eval_dataset,
     batch_size=config.batch_size,
     num_workers=config.num_workers,
     pin_memory=config.pin_memory,
-    shuffle=False,
+    sampler=eval_sampler,
 )
 
+# Batched LFCC on the training device when the datasets return waveforms
+frontend = None
+if train_dataset.return_waveform:
+    frontend = LFCCFrontend(
+        sample_rate=config.sr,
+        n_lfcc=config.n_lfcc,
+        n_fft=config.n_fft,
+        hop_length=config.hop_length,
+        fused=config.fused_frontend,
+    ).to(config.device)
+
 # Model Setup
 model = LCNN(
     sample_rate=config.sr,
     n_lfcc=config.n_lfcc,
     n_fft=config.n_fft,
     hop_length=config.hop_length,
+    chunk_length=config.chunk_length,
 ).to(config.device)
+if config.channels_last:
+    model.network.to(memory_format=torch.channels_last)
 logger.info(f"Using device: {config.device}")
+if config.compile:
+    warmup_seconds = compile_model(model, config, modes=("train", "eval"))
+    logger.info(f"Compiled model ({config.compile_mode}) in {warmup_seconds:.1f}s")
+
+# Gradients are all-reduced by the DDP wrapper, used for the training forward
+train_model = model
+if world_size > 1:
+    train_model = DistributedDataParallel(model)
+    logger.info(
+        f"Distributed training on {world_size} processes ({config.dist_backend})"
+    )
 
 criterion = torch.nn.CrossEntropyLoss()
+sample_criterion = torch.nn.CrossEntropyLoss(reduction="none")
+scaler = grad_scaler(config)
 optimizer = torch.optim.Adam(
     model.parameters(), lr=config.learning_rate, weight_decay=config.weight_decay
 )
@@ -86,82 +208,181 @@ scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
 )
 
 
-# Metrics:
-def compute_accuracy(predictions, targets):
-    correct = (predictions == targets).sum()
-    total = len(targets)
-    accuracy = 100 * correct / total
-    return accuracy
-
-
-def compute_eer(scores, targets):
-    fpr, tpr, thresholds = roc_curve(targets, scores, pos_label=1)
-    fnr = 1 - tpr
-    # Find the threshold where FPR and FNR are closest (EER point)
-
-    eer_idx = np.nanargmin(np.abs(fpr - fnr))
-    eer = (fpr[eer_idx] + fnr[eer_idx]) / 2
-    threshold = thresholds[eer_idx]
-
-    return eer, threshold
-
-
 # Training Loop:
+train_metrics = MetricsAccumulator(device=config.device)
+eval_metrics = MetricsAccumulator(
+    positive_class=config.class2idx["spoof"],
+    num_bins=config.metric_bins,
+    exact=config.exact_metrics,
+    device=config.device,
+)
 best_eval_loss = float("inf")
 save_epoch = 0
 eval_loss_list = []
 train_loss_list = []
 
-for epoch in range(config.num_epochs):
-    model.train()
-    total_loss = 0.0
-    for inputs, targets in tqdm(
-        train_dataloader, desc=f"Epoch {epoch + 1}/{config.num_epochs}"
-    ):
-        inputs = inputs.to(config.device)
-        targets = targets.to(config.device).long()
 
-        optimizer.zero_grad()
-        outputs = model(inputs)
-        loss = criterion(outputs, targets)
-        loss.backward()
-        optimizer.step()
+def training_state(epoch, step):
+    """Everything needed to continue from batch `step` of `epoch`."""
+    return {
+        "epoch": epoch,
+        "step": step,
+        "model": model.state_dict(),
+        "optimizer": optimizer.state_dict(),
+        "scheduler": scheduler.state_dict(),
+        "scaler": scaler.state_dict(),
+        "train_metrics": train_metrics.state_dict(),
+        "best_eval_loss": best_eval_loss,
+        "save_epoch": save_epoch,
+        "train_loss_list": train_loss_list,
+        "eval_loss_list": eval_loss_list,
+        "rng": rng_state(),
+        "importance_sampler": (
+            train_sampler.state_dict() if config.importance_sampling else None
+        ),
+    }
+
+
+checkpoint_path = Path(config.save_path) / "last_checkpoint.pth"
+checkpoint_writer = CheckpointWriter()
+start_epoch, start_step = 0, 0
+state = None
+if config.resume and is_main_process() and checkpoint_path.exists():
+    state = load_checkpoint(checkpoint_path)
+state = broadcast_object(state)
+if state is not None:
+    model.load_state_dict(state["model"])
+    optimizer.load_state_dict(state["optimizer"])
+    scheduler.load_state_dict(state["scheduler"])
+    scaler.load_state_dict(state["scaler"])
+    train_metrics.load_state_dict(state["train_metrics"])
+    best_eval_loss = state["best_eval_loss"]
+    save_epoch = state["save_epoch"]
+    train_loss_list = state["train_loss_list"]
+    eval_loss_list = state["eval_loss_list"]
+    set_rng_state(state["rng"])
+    if config.importance_sampling and state.get("importance_sampler") is not None:
+        train_sampler.load_state_dict(state["importance_sampler"])
+    start_epoch, start_step = state["epoch"], state["step"]
+    logger.info(
+        f"Resumed from {checkpoint_path} at epoch {start_epoch + 1}, step {start_step}"
+    )
+
+step_timer = StepTimer(config.device, enabled=config.timing_log_every > 0)
+profiler = StepProfiler(config.profile_steps, config.logs_path, config.device, rank)
+global_step = 0  # steps run by this process, for the profiler window
+
+for epoch in range(start_epoch, config.num_epochs):
+    model.train()
+    skip_steps = start_step if epoch == start_epoch else 0
+    if skip_steps == 0:
+        train_metrics.reset()
+    train_batches = train_dataloader
+    if train_sampler is not None:
+        train_sampler.set_epoch(epoch, start=skip_steps * config.batch_size)
+    if iterable_data:
+        # Iterable datasets replay the epoch's stream up to the saved batch
+        train_dataset.set_epoch(epoch)
+        train_batches = itertools.islice(train_dataloader, skip_steps, None)
+    # Ranks of an iterable dataset can get different batch counts; join()
+    # keeps the gradient all-reduce of the ranks that still have data going
+    join = train_model.join() if world_size > 1 and iterable_data else nullcontext()
+    step_timer.restart()
+    with join:
+        # AudioDataset adds per-chunk loss weights for silence_policy "weight"
+        for step, (inputs, targets, *weights) in enumerate(
+            tqdm(
+                train_batches,
+                desc=f"Epoch {epoch + 1}/{config.num_epochs}",
+                disable=not is_main_process(),
+            ),
+            start=skip_steps,
+        ):
+            step_timer.mark("data")
+            trace_path = profiler.step(global_step)
+            if trace_path is not None:
+                logger.info(f"Profiler trace written to {trace_path}")
+            global_step += 1
+            step_timer.restart()  # profiler start/export is not part of the step
 
-        total_loss += loss.item()
+            inputs = inputs.to(config.device)
+            targets = targets.to(config.device).long()
+            weights = weights[0].to(config.device) if weights else None
+            importance = None
+            if config.importance_sampling:
+                batch_indices = train_sampler.batch_indices(step, config.batch_size)
+                importance = train_sampler.weights[batch_indices].to(config.device)
+            step_timer.mark("h2d")
+            if frontend is not None:
+                inputs = to_model_layout(frontend(inputs))
+            if config.channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+
+            optimizer.zero_grad()
+            with autocast(config):
+                outputs = train_model(inputs)
+                if weights is None and importance is None:
+                    loss = criterion(outputs, targets)
+                else:
+                    losses = sample_criterion(outputs, targets)
+                    if weights is None:
+                        weights = torch.ones_like(losses)
+                    # Importance weights undo the loss-proportional sampling
+                    scale = weights if importance is None else weights * importance
+                    loss = (losses * scale).sum() / weights.sum()
+            step_timer.mark("forward")
+            scaler.scale(loss).backward()
+            step_timer.mark("backward")
+            scaler.step(optimizer)
+            scaler.update()
+
+            train_metrics.add_loss(loss)
+            if config.importance_sampling:
+                train_sampler.update(batch_indices, losses)
+            step_timer.mark("optimizer")
+
+            if (
+                config.checkpoint_every > 0
+                and (step + 1) % config.checkpoint_every == 0
+            ):
+                if is_main_process():
+                    checkpoint_writer.save(
+                        training_state(epoch, step + 1), checkpoint_path
+                    )
+            if (
+                config.timing_log_every > 0
+                and global_step % config.timing_log_every == 0
+            ):
+                logger.info(step_timer.report())
+            step_timer.restart()
 
     # Evaluation Loop:
     model.eval()
-    all_predictions = []
-    all_targets = []
-    all_scores = []
-    eval_loss = 0
+    eval_metrics.reset()
     with torch.no_grad():
-        for inputs, targets in tqdm(eval_dataloader, desc="Evaluating"):
+        for inputs, targets in tqdm(
+            eval_dataloader, desc="Evaluating", disable=not is_main_process()
+        ):
             inputs = inputs.to(config.device)
+            if frontend is not None:
+                inputs = to_model_layout(frontend(inputs))
+            if config.channels_last:
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
             targets = targets.to(config.device).long()
 
-            outputs = model(inputs)
+            with autocast(config):
+                outputs = model(inputs)
+            outputs = outputs.float()
             loss = criterion(outputs, targets)
-            eval_loss += loss.item()
-
-            probabilities = torch.nn.functional.softmax(outputs, dim=1)
-            # Probabilities of spoof class
-            spoof_scores = probabilities[:, config.class2idx["spoof"]]
-            _, predicted = torch.max(outputs, 1)
-
-            all_predictions.extend(predicted.cpu().tolist())
-            all_targets.extend(targets.cpu().tolist())
-            all_scores.extend(spoof_scores.cpu().tolist())
-
-    all_predictions = np.array(all_predictions)
-    all_targets = np.array(all_targets)
-    all_scores = np.array(all_scores)
-
-    accuracy = compute_accuracy(all_predictions, all_targets)
-    eer, eer_threshold = compute_eer(all_scores, all_targets)
-
-    avg_loss = total_loss / len(train_dataloader)
-    avg_eval_loss = eval_loss / len(eval_dataloader)
+            eval_metrics.update(outputs, targets, loss)
+
+    # Single host sync per epoch
+    train_metrics.all_reduce()
+    eval_metrics.all_reduce()
+    results = eval_metrics.compute()
+    accuracy, eer = results["accuracy"], results["eer"]
+    avg_loss = train_metrics.compute()["loss"]
+    avg_eval_loss = results["loss"]
     current_lr = optimizer.param_groups[0]["lr"]
 
     logger.info(
@@ -169,24 +390,50 @@ for epoch in range(config.num_epochs):
         f"Train_Loss: {avg_loss:.4f}, Eval_Loss: {avg_eval_loss:.4f}, "
         f"Accuracy: {accuracy:.2f}%%, EER: {eer:.4f}, LR: {current_lr:.2e}"
     )
+    if config.importance_sampling:
+        logger.info(
+            f"Importance sampling - {train_sampler.num_draws} draws "
+            f"({len(train_sampler.draws.unique())} distinct) of "
+            f"{train_sampler.num_samples} chunks, "
+            f"largest weight {float(train_sampler.weights.max()):.2f}"
+        )
+    if config.audio_cache_mb > 0 and config.data_mode == "raw":
+        for split, dataset in [("train", train_dataset), ("eval", eval_dataset)]:
+            cache = dataset.cache_report()
+            logger.info(
+                f"Audio cache ({split}) - Hit rate: {cache['hit_rate']:.1%}, "
+                f"Decodes: {cache['decodes']}, Memory: {cache['cache_mb']:.1f} MB"
+            )
     eval_loss_list.append(avg_eval_loss)
     train_loss_list.append(avg_loss)
 
     scheduler.step(avg_eval_loss)
     if avg_eval_loss < best_eval_loss:
         best_eval_loss = avg_eval_loss
-        torch.save(model.state_dict(), f"{config.save_path}/best_model.pth")
+        if is_main_process():
+            checkpoint_writer.save(
+                model.state_dict(), f"{config.save_path}/best_model.pth"
+            )
         logger.info(f"Best model saved with accuracy: {accuracy:.2f}%%")
         save_epoch = epoch + 1
+    if is_main_process():
+        checkpoint_writer.save(training_state(epoch + 1, 0), checkpoint_path)
+
+trace_path = profiler.stop()
+if trace_path is not None:
+    logger.info(f"Profiler trace written to {trace_path}")
+checkpoint_writer.close()
+cleanup_distributed()
 
 num_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
 logger.info(f"Model has {num_params} trainable parameters.")
-plt.figure()
-plt.plot(range(1, config.num_epochs + 1), train_loss_list, label="Train Loss")
-plt.plot(range(1, config.num_epochs + 1), eval_loss_list, label="Eval Loss")
-plt.axvline(x=save_epoch, color="r", linestyle="--", label="Best Model Epoch")
-plt.xlabel("Epoch")
-plt.ylabel("Loss")
-plt.title("Training and Evaluation Loss over Epochs")
-plt.legend()
-plt.savefig(f"{config.logs_path}/loss_curve.png")
+if rank == 0:
+    plt.figure()
+    plt.plot(range(1, config.num_epochs + 1), train_loss_list, label="Train Loss")
+    plt.plot(range(1, config.num_epochs + 1), eval_loss_list, label="Eval Loss")
+    plt.axvline(x=save_epoch, color="r", linestyle="--", label="Best Model Epoch")
+    plt.xlabel("Epoch")
+    plt.ylabel("Loss")
+    plt.title("Training and Evaluation Loss over Epochs")
+    plt.legend()
+    plt.savefig(f"{config.logs_path}/loss_curve.png")
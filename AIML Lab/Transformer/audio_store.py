@@ -0,0 +1,229 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import torch
+from audio_dataset import load_audio, split_chunks
+from frontend import LFCCFrontend
+from tqdm import tqdm
+
+
+class MemmapStore:
+    """Per-file arrays for a whole protocol list concatenated in one flat file.
+    Row `i` of file `f` lives at `offset(f) + i`, so slices are served straight
+    from the memory map without touching the original FLAC files.
+    """
+
+    def __init__(
+        self, data_path, dtype, file_paths, offsets, lengths, num_samples, row_shape=()
+    ):
+        self.data_path = str(data_path)
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.offsets = {
+            path: (int(offset), int(length))
+            for path, offset, length in zip(file_paths, offsets, lengths)
+        }
+        self._num_samples = dict(zip(file_paths, np.asarray(num_samples).tolist()))
+        self._data = None
+
+    def __getstate__(self):
+        # Each DataLoader worker maps the file itself
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    @property
+    def data(self):
+        if self._data is None:
+            # Copy-on-write keeps slices writable for torch without copying
+            self._data = np.memmap(self.data_path, dtype=self.dtype, mode="c")
+            self._data = self._data.reshape(-1, *self.row_shape)
+        return self._data
+
+    def num_samples(self, file_path):
+        """Length of the resampled audio the rows of `file_path` came from."""
+        return self._num_samples[file_path]
+
+    def read(self, file_path, start, num):
+        offset, length = self.offsets[file_path]
+        return self.data[
+            offset + min(start, length) : offset + min(start + num, length)
+        ]
+
+
+class PCMStore(MemmapStore):
+    """Decoded, resampled audio, one sample per row."""
+
+    def read(self, file_path, start, num):
+        chunk = super().read(file_path, start, num)
+        if self.dtype == np.int16:
+            chunk = chunk.astype(np.float32) / 32768.0
+        return chunk
+
+
+class LFCCStore(MemmapStore):
+    """Per-chunk LFCC, one (chunk_frames, n_lfcc) float16 chunk per row."""
+
+
+def _store_files(config, name, kind):
+    store_dir = Path(config.store_path)
+    return store_dir / f"{name}.{kind}", store_dir / f"{name}_{kind}_index.npz"
+
+
+def _load_store(store_cls, data_path, index_path):
+    index = np.load(index_path)
+    return store_cls(
+        data_path,
+        dtype=str(index["dtype"]),
+        file_paths=index["file_paths"].tolist(),
+        offsets=index["offsets"],
+        lengths=index["lengths"],
+        num_samples=index["num_samples"],
+        row_shape=index["row_shape"].tolist(),
+    )
+
+
+def _file_mtimes(file_paths):
+    return np.array(
+        [os.stat(file_path).st_mtime_ns for file_path in file_paths], dtype=np.int64
+    )
+
+
+def _is_up_to_date(data_path, index_path, file_paths, params):
+    if not index_path.exists() or not data_path.exists():
+        return False
+    index = np.load(index_path)
+    return (
+        str(index["params"]) == params
+        and index["file_paths"].tolist() == file_paths
+        # A file re-encoded or replaced at the same path needs a rebuild
+        and "mtimes" in index.files
+        and np.array_equal(index["mtimes"], _file_mtimes(file_paths))
+    )
+
+
+def _write_store(
+    store_cls,
+    data_path,
+    index_path,
+    file_paths,
+    params,
+    dtype,
+    row_shape,
+    rows_fn,
+    desc,
+):
+    data_path.parent.mkdir(parents=True, exist_ok=True)
+    # Taken before decoding, so a file changed mid-build is rebuilt next time
+    mtimes = _file_mtimes(file_paths)
+    tmp_path = data_path.with_suffix(data_path.suffix + ".tmp")
+    offsets = np.zeros(len(file_paths), dtype=np.int64)
+    lengths = np.zeros(len(file_paths), dtype=np.int64)
+    num_samples = np.zeros(len(file_paths), dtype=np.int64)
+    offset = 0
+    with open(tmp_path, "wb") as f:
+        for file_idx, file_path in enumerate(tqdm(file_paths, desc=desc)):
+            rows, num_samples[file_idx] = rows_fn(file_path)
+            f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+            offsets[file_idx] = offset
+            lengths[file_idx] = len(rows)
+            offset += len(rows)
+
+    tmp_path.replace(data_path)
+    np.savez(
+        index_path,
+        file_paths=np.array(file_paths),
+        mtimes=mtimes,
+        offsets=offsets,
+        lengths=lengths,
+        num_samples=num_samples,
+        dtype=np.dtype(dtype).name,
+        row_shape=np.array(row_shape, dtype=np.int64),
+        params=params,
+    )
+    return _load_store(store_cls, data_path, index_path)
+
+
+def build_pcm_store(audio_list, config, name):
+    """Decode and resample every file in `audio_list` once into `name`.pcm.
+    Reuses the existing store when it was built for the same files (and
+    mtimes), sr and dtype.
+    """
+    data_path, index_path = _store_files(config, name, "pcm")
+    file_paths = [file_path for file_path, _ in audio_list]
+    params = f"sr={config.sr},dtype={config.pcm_dtype}"
+    if _is_up_to_date(data_path, index_path, file_paths, params):
+        return _load_store(PCMStore, data_path, index_path)
+
+    dtype = np.dtype(config.pcm_dtype)
+    if dtype not in (np.float32, np.int16):
+        raise ValueError(f"Unsupported pcm_dtype: {config.pcm_dtype}")
+
+    def pcm_rows(file_path):
+        audio = load_audio(file_path, config.sr)
+        if dtype == np.int16:
+            audio = np.clip(audio * 32768.0, -32768, 32767)
+        return audio, len(audio)
+
+    return _write_store(
+        PCMStore,
+        data_path,
+        index_path,
+        file_paths,
+        params,
+        dtype,
+        (),
+        pcm_rows,
+        desc=f"PCM store {name}",
+    )
+
+
+def build_lfcc_store(audio_list, config, name):
+    """Compute the LFCC of every chunk once into `name`.lfcc as float16. Each
+    chunk is cut, zero-padded and transformed on its own, exactly as raw mode
+    and `LFCCFrontend` do (reflect padding at its edges, `top_db` clamp to its
+    own peak), so overlapping audio is stored once per chunk that covers it.
+    """
+    chunk_samples = int(config.chunk_length * config.sr)
+    step_samples = chunk_samples - int(config.chunk_overlap * config.sr)
+    chunk_frames = chunk_samples // config.hop_length + 1
+
+    data_path, index_path = _store_files(config, name, "lfcc")
+    file_paths = [file_path for file_path, _ in audio_list]
+    params = (
+        f"sr={config.sr},n_lfcc={config.n_lfcc},n_fft={config.n_fft},"
+        f"hop_length={config.hop_length},chunk_length={config.chunk_length},"
+        f"chunk_overlap={config.chunk_overlap},layout=chunks"
+    )
+    if _is_up_to_date(data_path, index_path, file_paths, params):
+        return _load_store(LFCCStore, data_path, index_path)
+
+    frontend = LFCCFrontend(
+        sample_rate=config.sr,
+        n_lfcc=config.n_lfcc,
+        n_fft=config.n_fft,
+        hop_length=config.hop_length,
+    )
+
+    def lfcc_rows(file_path):
+        audio = torch.from_numpy(load_audio(file_path, config.sr))
+        chunks = split_chunks(audio, chunk_samples, step_samples)
+        if len(chunks) == 0:
+            return np.zeros((0, chunk_frames, config.n_lfcc)), len(audio)
+        with torch.no_grad():
+            # (num_chunks, chunk_frames, n_lfcc)
+            rows = frontend(chunks).transpose(1, 2)
+        return rows.numpy(), len(audio)
+
+    return _write_store(
+        LFCCStore,
+        data_path,
+        index_path,
+        file_paths,
+        params,
+        np.float16,
+        (chunk_frames, config.n_lfcc),
+        lfcc_rows,
+        desc=f"LFCC store {name}",
+    )
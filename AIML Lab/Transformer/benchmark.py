@@ -0,0 +1,359 @@
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, replace
+from datetime import datetime, timezone
+from pathlib import Path
+
+import torch
+from audio_dataset import AudioDataset, Config, iter_protocol, to_model_layout
+from compilation import compile_model, example_batch
+from frontend import LFCCFrontend
+from model import AudioSpoofTransformer
+from precision import autocast
+from synthetic import make_corpus
+from torch.utils.data import DataLoader
+
+
+def build_model(config):
+    return AudioSpoofTransformer(config).to(config.device)
+
+
+def time_steps(model, config, num_steps, train, skip_steps=3):
+    """Median seconds per train step (forward, backward, Adam) or per no-grad
+    forward over a random batch. The first `skip_steps` steps are not timed."""
+    inputs = torch.randn_like(example_batch(config))
+    targets = torch.randint(0, 2, (config.batch_size,), device=config.device)
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
+    model.train(train)
+
+    step_times = []
+    for step in range(skip_steps + num_steps):
+        start_time = time.perf_counter()
+        if train:
+            optimizer.zero_grad()
+            with autocast(config):
+                loss = criterion(model(inputs), targets)
+            loss.backward()
+            optimizer.step()
+        else:
+            with torch.no_grad(), autocast(config):
+                model(inputs)
+        if config.device.type == "cuda":
+            torch.cuda.synchronize()
+        if step >= skip_steps:
+            step_times.append(time.perf_counter() - start_time)
+    return statistics.median(step_times)
+
+
+def benchmark_compile(config, num_steps=20):
+    """Eager vs torch.compile step time for training and inference."""
+    results = {}
+    for name in ("eager", "compiled"):
+        torch.manual_seed(config.seed)
+        model = build_model(config)
+        warmup_seconds = 0.0
+        if name == "compiled":
+            warmup_seconds = compile_model(model, config, modes=("train", "eval"))
+        results[name] = {
+            "warmup_s": warmup_seconds,
+            "train_step_ms": 1e3 * time_steps(model, config, num_steps, train=True),
+            "eval_step_ms": 1e3 * time_steps(model, config, num_steps, train=False),
+        }
+    for key in ("train_step_ms", "eval_step_ms"):
+        speedup = results["eager"][key] / results["compiled"][key]
+        results[key.replace("_ms", "_speedup")] = speedup
+    return results
+
+
+def activation_memory(model, config):
+    """MB of distinct tensors autograd keeps for backward over one training
+    forward (with activation checkpointing, this leaves out the one input
+    per checkpointed layer that the checkpoint itself holds)."""
+    inputs = torch.randn_like(example_batch(config))
+    storages = {}
+
+    def pack(tensor):
+        storage = tensor.untyped_storage()
+        storages[storage.data_ptr()] = storage.nbytes()
+        return tensor
+
+    model.train()
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        with autocast(config):
+            model(inputs)
+    return sum(storages.values()) / 2**20
+
+
+def benchmark_checkpointing(config, chunk_lengths=(1, 2, 3), num_steps=3):
+    """Activation memory and train step time without and with every encoder
+    layer checkpointed, for several chunk lengths (sequence lengths).
+    Yields one result per setting, so long runs report as they go."""
+    for chunk_length in chunk_lengths:
+        for checkpoint_layers in (0, config.num_layers):
+            run_config = replace(
+                config,
+                chunk_length=chunk_length,
+                activation_checkpointing=checkpoint_layers,
+            )
+            run_config.device = config.device
+            torch.manual_seed(config.seed)
+            model = build_model(run_config)
+            yield {
+                "chunk_length": chunk_length,
+                "checkpoint_layers": checkpoint_layers,
+                "activation_mb": activation_memory(model, run_config),
+                "train_step_ms": 1e3
+                * time_steps(model, run_config, num_steps, train=True, skip_steps=1),
+            }
+
+
+def time_forward_backward(model, config, num_steps, skip_steps=3):
+    """Median seconds of the training forward (with loss) and of backward."""
+    inputs = torch.randn_like(example_batch(config))
+    targets = torch.randint(0, 2, (config.batch_size,), device=config.device)
+    criterion = torch.nn.CrossEntropyLoss()
+    model.train()
+
+    forward_times, backward_times = [], []
+    for step in range(skip_steps + num_steps):
+        model.zero_grad()
+        start_time = time.perf_counter()
+        with autocast(config):
+            loss = criterion(model(inputs), targets)
+        if config.device.type == "cuda":
+            torch.cuda.synchronize()
+        forward_time = time.perf_counter() - start_time
+        loss.backward()
+        if config.device.type == "cuda":
+            torch.cuda.synchronize()
+        if step >= skip_steps:
+            forward_times.append(forward_time)
+            backward_times.append(time.perf_counter() - start_time - forward_time)
+    return statistics.median(forward_times), statistics.median(backward_times)
+
+
+def benchmark_model(config, batch_sizes=(1, 8, 32), num_steps=5):
+    """Eval forward, training forward/backward and full train step latency
+    per batch size."""
+    results = {}
+    for batch_size in batch_sizes:
+        run_config = replace(config, batch_size=batch_size)
+        run_config.device = config.device
+        torch.manual_seed(config.seed)
+        model = build_model(run_config)
+        forward_s, backward_s = time_forward_backward(model, run_config, num_steps)
+        results[batch_size] = {
+            "eval_forward_ms": 1e3
+            * time_steps(model, run_config, num_steps, train=False),
+            "train_forward_ms": 1e3 * forward_s,
+            "backward_ms": 1e3 * backward_s,
+            "train_step_ms": 1e3 * time_steps(model, run_config, num_steps, train=True),
+        }
+    return results
+
+
+def benchmark_index(audio_list, config):
+    """Seconds to build the chunk index from the file headers (no index
+    cache). Returns (seconds, dataset)."""
+    start_time = time.perf_counter()
+    dataset = AudioDataset(audio_list, config=replace(config, index_cache_path=None))
+    return time.perf_counter() - start_time, dataset
+
+
+def benchmark_getitem(dataset, num_items=200, seed=0):
+    """`__getitem__` calls per second in this process, i.e. what one
+    DataLoader worker delivers, over randomly drawn chunks."""
+    generator = torch.Generator().manual_seed(seed)
+    indices = torch.randint(len(dataset), (num_items,), generator=generator).tolist()
+    start_time = time.perf_counter()
+    for idx in indices:
+        dataset[idx]
+    return num_items / (time.perf_counter() - start_time)
+
+
+def benchmark_dataloader(dataset, config, worker_counts=(0, 1, 2, 4), num_batches=20):
+    """Shuffled DataLoader samples per second for each worker count. Worker
+    start-up and the first batch are timed separately as `startup_s`."""
+    results = {}
+    for num_workers in worker_counts:
+        dataloader = DataLoader(
+            dataset,
+            batch_size=config.batch_size,
+            num_workers=num_workers,
+            shuffle=True,
+            generator=torch.Generator().manual_seed(config.seed),
+        )
+        start_time = time.perf_counter()
+        batches = iter(dataloader)
+        next(batches)
+        startup_seconds = time.perf_counter() - start_time
+
+        num_samples = 0
+        start_time = time.perf_counter()
+        for inputs, _ in itertools.islice(batches, num_batches):
+            num_samples += len(inputs)
+        seconds = time.perf_counter() - start_time
+        del batches
+        results[num_workers] = {
+            "samples_per_s": num_samples / max(seconds, 1e-9),
+            "startup_s": startup_seconds,
+        }
+    return results
+
+
+def benchmark_epoch(dataset, config):
+    """Wall time of one training epoch over `dataset`, as in train.py minus
+    evaluation and checkpointing: loading, LFCC, forward, backward, Adam."""
+    dataloader = DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+        shuffle=True,
+        generator=torch.Generator().manual_seed(config.seed),
+    )
+    frontend = None
+    if dataset.return_waveform:
+        frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+    torch.manual_seed(config.seed)
+    model = build_model(config)
+    model.train()
+    criterion = torch.nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
+
+    start_time = time.perf_counter()
+    for inputs, targets in dataloader:
+        inputs = inputs.to(config.device)
+        if frontend is not None:
+            inputs = to_model_layout(frontend(inputs))
+        if getattr(config, "channels_last", False):
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        targets = targets.to(config.device).long()
+
+        optimizer.zero_grad()
+        with autocast(config):
+            loss = criterion(model(inputs), targets)
+        loss.backward()
+        optimizer.step()
+    if config.device.type == "cuda":
+        torch.cuda.synchronize()
+    seconds = time.perf_counter() - start_time
+    return {"seconds": seconds, "samples_per_s": len(dataset) / seconds}
+
+
+def environment(config):
+    """Where and on what the numbers were measured."""
+    commit = subprocess.run(
+        ["git", "rev-parse", "HEAD"],
+        capture_output=True,
+        text=True,
+        cwd=Path(__file__).parent,
+    ).stdout.strip()
+    return {
+        "commit": commit or None,
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "device": str(config.device),
+    }
+
+
+def run_suite(config, output_path, num_files=64, worker_counts=(0, 1, 2, 4)):
+    """Generate a synthetic corpus, run every benchmark on it and write the
+    results as JSON to `output_path`."""
+    model = build_model(config)
+    results = {
+        "environment": environment(config),
+        "model": {
+            "name": type(model).__name__,
+            "parameters": sum(p.numel() for p in model.parameters()),
+        },
+        "config": asdict(config),
+    }
+    del model
+
+    with tempfile.TemporaryDirectory() as corpus_root:
+        start_time = time.perf_counter()
+        protocol_path, flac_dir = make_corpus(
+            corpus_root, num_files=num_files, sr=config.sr, seed=config.seed
+        )
+        audio_list = list(iter_protocol(protocol_path, flac_dir))
+        results["corpus"] = {
+            "files": num_files,
+            "generate_s": time.perf_counter() - start_time,
+        }
+
+        index_seconds, dataset = benchmark_index(audio_list, config)
+        results["corpus"]["chunks"] = len(dataset)
+        results["index_build_s"] = index_seconds
+        results["getitem_per_s"] = benchmark_getitem(dataset, seed=config.seed)
+        results["dataloader"] = benchmark_dataloader(dataset, config, worker_counts)
+        results["latency"] = benchmark_model(config)
+        results["epoch"] = benchmark_epoch(dataset, config)
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    config = Config()
+    config.device = torch.device("cpu")
+
+    if sys.argv[1:2] == ["suite"]:
+        # python benchmark.py suite [output.json]
+        commit = environment(config)["commit"] or "unknown"
+        output_path = (
+            sys.argv[2]
+            if len(sys.argv) > 2
+            else f"{config.logs_path}/benchmark_{commit[:8]}.json"
+        )
+        results = run_suite(config, output_path)
+        print(
+            f"Index build {results['index_build_s']:.2f} s for "
+            f"{results['corpus']['chunks']} chunks, "
+            f"__getitem__ {results['getitem_per_s']:.0f}/s, "
+            f"epoch {results['epoch']['seconds']:.1f} s"
+        )
+        print(f"Results written to {output_path}")
+        sys.exit()
+
+    if "checkpointing" in sys.argv[1:]:
+        for result in benchmark_checkpointing(config):
+            print(
+                f"{result['chunk_length']} s chunks, "
+                f"{result['checkpoint_layers']} checkpointed layers: "
+                f"activations {result['activation_mb']:.0f} MB, "
+                f"train step {result['train_step_ms']:.0f} ms"
+            )
+        sys.exit()
+
+    results = benchmark_compile(config)
+    for name in ("eager", "compiled"):
+        print(
+            f"{name:>8}: train step {results[name]['train_step_ms']:.1f} ms, "
+            f"eval step {results[name]['eval_step_ms']:.1f} ms, "
+            f"warm-up {results[name]['warmup_s']:.1f} s"
+        )
+    print(
+        f"Speedup - train: {results['train_step_speedup']:.2f}x, "
+        f"eval: {results['eval_step_speedup']:.2f}x "
+        f"(batch {config.batch_size}, {config.compile_mode} mode)"
+    )
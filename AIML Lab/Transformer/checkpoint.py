@@ -0,0 +1,101 @@
+import copy
+import os
+import queue
+import random
+import threading
+from pathlib import Path
+
+import numpy as np
+import torch
+
+
+def snapshot(state):
+    """Copy every tensor in a (nested) state dict to host memory, so training
+    can keep updating the live tensors while the copy is written out."""
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot(value) for value in state)
+    return copy.deepcopy(state)
+
+
+def atomic_save(state, path):
+    """torch.save to a temporary file, fsync it and rename it over `path`, so
+    an interrupted write leaves the previous file intact."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    # Our own files; they carry numpy/python RNG state, so not weights_only
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class CheckpointWriter:
+    """Writes checkpoints with `atomic_save` on a background thread.
+    `save` takes the host snapshot on the caller's thread and returns; at most
+    one write is queued behind the one in progress, after that `save` blocks.
+    Errors from the writer thread are raised on the next `save`/`close`.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=1)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                atomic_save(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Checkpoint write failed") from error
+
+    def save(self, state, path):
+        self._raise_error()
+        self._queue.put((snapshot(state), Path(path)))
+
+    def wait(self):
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        self._queue.put(None)
+        self._thread.join()
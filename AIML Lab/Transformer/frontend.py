@@ -0,0 +1,96 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torchaudio.functional as AF
+
+
+class LFCCFrontend(nn.Module):
+    """Batched LFCC, numerically matching torchaudio.transforms.LFCC applied to
+    each sample on its own (including the per-sample top_db clamp).
+    Input:  (batch, samples)
+    Output: (batch, n_lfcc, time_frames)
+
+    The log between the linear filterbank and the DCT keeps them two matmuls.
+    With `fused=True` the Hann window and the real DFT are folded into a single
+    (n_fft, 2 * n_freqs) matrix applied to the framed signal instead of torch.stft.
+    """
+
+    def __init__(
+        self,
+        sample_rate,
+        n_lfcc,
+        n_fft,
+        hop_length,
+        n_filter=128,
+        top_db=80.0,
+        fused=False,
+    ):
+        super().__init__()
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.top_db = top_db
+        self.fused = fused
+
+        n_freqs = n_fft // 2 + 1
+        window = torch.hann_window(n_fft)
+        self.register_buffer("window", window)
+        self.register_buffer(
+            "filter_mat",
+            AF.linear_fbanks(n_freqs, 0.0, sample_rate / 2, n_filter, sample_rate),
+        )  # (n_freqs, n_filter)
+        self.register_buffer(
+            "dct_mat", AF.create_dct(n_lfcc, n_filter, norm="ortho")
+        )  # (n_filter, n_lfcc)
+
+        if fused:
+            time = torch.arange(n_fft, dtype=torch.float64).unsqueeze(1)
+            freq = torch.arange(n_freqs, dtype=torch.float64).unsqueeze(0)
+            angle = 2 * torch.pi * time * freq / n_fft
+            basis = torch.cat([torch.cos(angle), -torch.sin(angle)], dim=1)
+            basis = basis * window.double().unsqueeze(1)
+            self.register_buffer("dft_basis", basis.float())  # (n_fft, 2 * n_freqs)
+
+    def frame_power(self, frames):
+        """Power spectrum of already framed audio, as `power_spectrum` computes
+        it for each frame. (..., n_fft) -> (..., n_freqs)"""
+        if self.fused:
+            real, imag = (frames @ self.dft_basis).chunk(2, dim=-1)
+            return real.square() + imag.square()
+        return torch.fft.rfft(frames * self.window).abs().square()
+
+    def power_spectrum(self, waveform):
+        """(batch, samples) -> (batch, time_frames, n_freqs)"""
+        if self.fused:
+            pad = self.n_fft // 2
+            padded = F.pad(waveform.unsqueeze(1), (pad, pad), mode="reflect")
+            frames = padded.squeeze(1).unfold(-1, self.n_fft, self.hop_length)
+            return self.frame_power(frames)
+
+        spec = torch.stft(
+            waveform,
+            n_fft=self.n_fft,
+            hop_length=self.hop_length,
+            window=self.window,
+            center=True,
+            pad_mode="reflect",
+            return_complex=True,
+        )
+        return spec.abs().square().transpose(-1, -2)
+
+    def filterbank_db(self, power):
+        """(batch, time_frames, n_freqs) -> (batch, time_frames, n_filter) in dB"""
+        energies = power @ self.filter_mat
+        return 10.0 * torch.log10(energies.clamp(min=1e-10))
+
+    def cepstrum(self, energies_db):
+        """Clamp to `top_db` below each sample's peak, then DCT.
+        (batch, time_frames, n_filter) -> (batch, n_lfcc, time_frames)
+        """
+        peak = energies_db.amax(dim=(-2, -1), keepdim=True)
+        energies_db = torch.maximum(energies_db, peak - self.top_db)
+        return (energies_db @ self.dct_mat).transpose(-1, -2)
+
+    def forward(self, waveform):
+        if waveform.dim() == 1:
+            return self.forward(waveform.unsqueeze(0)).squeeze(0)
+        return self.cepstrum(self.filterbank_db(self.power_spectrum(waveform)))
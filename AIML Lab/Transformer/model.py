@@ -2,26 +2,36 @@ import math
 
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 
 
-class PositionalEncoding(nn.Module):
-    def __init__(self, d_model, max_len):
-        super().__init__()
+def sinusoid_table(length, d_model, device=None):
+    """(length, d_model) sinusoidal position encodings."""
+    position = torch.arange(0, length, device=device).unsqueeze(1).float()
+    div_term = torch.exp(
+        torch.arange(0, d_model, 2, device=device).float()
+        * (-math.log(10000.0) / d_model)
+    )
 
-        pe = torch.zeros(max_len, d_model)
-        position = torch.arange(0, max_len).unsqueeze(1).float()
+    pe = torch.zeros(length, d_model, device=device)
+    pe[:, 0::2] = torch.sin(position * div_term)
+    pe[:, 1::2] = torch.cos(position * div_term)
+    return pe
 
-        div_term = torch.exp(
-            torch.arange(0, d_model, 2).float() * (-math.log(10000.0) / d_model)
-        )
 
-        pe[:, 0::2] = torch.sin(position * div_term)
-        pe[:, 1::2] = torch.cos(position * div_term)
+class PositionalEncoding(nn.Module):
+    """Sinusoidal encodings, precomputed for `max_len` frames. Longer inputs
+    (whole utterances) get theirs computed on the fly."""
 
-        self.register_buffer("pe", pe.unsqueeze(0))
+    def __init__(self, d_model, max_len):
+        super().__init__()
+        self.register_buffer("pe", sinusoid_table(max_len, d_model).unsqueeze(0))
 
     def forward(self, x):
         time_dim = x.size(1)
+        if time_dim > self.pe.size(1):  # pyright: ignore[reportAttributeAccessIssue]
+            pe = sinusoid_table(time_dim, x.size(2), device=x.device)
+            return x + pe.to(x.dtype)
         return x + self.pe[:, :time_dim]  # pyright: ignore[reportIndexIssue]
 
 
@@ -46,13 +56,39 @@ class AudioSpoofTransformer(nn.Module):
         )
 
         self.classifier = nn.Linear(config.d_model, config.num_classes)
+        # First N encoder layers recompute their activations in backward
+        self.checkpoint_layers = config.activation_checkpointing
 
-    def forward(self, x):
+    def forward(self, x, padding_mask=None):
+        """x: (batch, time_frames, n_lfcc). For batches of different lengths
+        `padding_mask` (batch, time_frames) is True on padded frames: they are
+        masked out of attention and of the mean pooling. In eval mode under
+        no_grad the encoder then runs on nested tensors and skips them."""
         x = self.input_proj(x)
         x = self.dropout(x)
         x = self.pos_enc(x)
-        x = self.encoder(x)
+        if self.training and self.checkpoint_layers > 0:
+            x = self._checkpointed_encoder(x, padding_mask)
+        else:
+            x = self.encoder(x, src_key_padding_mask=padding_mask)
 
-        x = x.mean(dim=1)
+        if padding_mask is None:
+            x = x.mean(dim=1)
+        else:
+            valid = (~padding_mask).unsqueeze(-1).to(x.dtype)
+            x = (x * valid).sum(dim=1) / valid.sum(dim=1).clamp(min=1)
         logits = self.classifier(x)
         return logits
+
+    def _checkpointed_encoder(self, x, padding_mask):
+        """The encoder's layers one by one, with the first `checkpoint_layers`
+        wrapped in activation checkpointing: only each layer's input is kept
+        for backward and the layer is run again to get the rest."""
+        for layer_idx, layer in enumerate(self.encoder.layers):
+            if layer_idx < self.checkpoint_layers:
+                x = checkpoint(
+                    layer, x, src_key_padding_mask=padding_mask, use_reentrant=False
+                )
+            else:
+                x = layer(x, src_key_padding_mask=padding_mask)
+        return x
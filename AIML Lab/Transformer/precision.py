@@ -0,0 +1,20 @@
+import torch
+
+AMP_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+
+def autocast(config):
+    """Autocast context for `config.precision` ("fp32" disables it)."""
+    if config.precision not in ("fp32", *AMP_DTYPES):
+        raise ValueError(f"Unsupported precision: {config.precision}")
+    return torch.autocast(
+        device_type=config.device.type,
+        dtype=AMP_DTYPES.get(config.precision, torch.bfloat16),
+        enabled=config.precision != "fp32",
+    )
+
+
+def grad_scaler(config):
+    """Loss scaling is only needed for fp16; bf16 keeps the fp32 exponent range,
+    so for "fp32" and "bf16" the scaler is a pass-through."""
+    return torch.amp.GradScaler(config.device.type, enabled=config.precision == "fp16")
@@ -0,0 +1,101 @@
+import time
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+import torch
+
+STEP_PHASES = ("data", "h2d", "forward", "backward", "optimizer")
+
+
+class StepTimer:
+    """Wall time of each phase of a training step over the last `window` steps.
+    `mark(phase)` books the time since the previous mark to `phase`, so the
+    "data" mark at the top of the loop measures how long the step waited for
+    the DataLoader. `restart()` excludes what runs between steps (checkpoint
+    writes, evaluation) from the next data wait. On CUDA every mark
+    synchronizes, so queued kernels are charged to the phase that ran them;
+    with `enabled=False` marks do nothing.
+    """
+
+    def __init__(self, device, window=100, enabled=True):
+        self.enabled = enabled
+        self.sync = device.type == "cuda"
+        self.times = {phase: deque(maxlen=window) for phase in STEP_PHASES}
+        self._last = time.perf_counter()
+
+    def restart(self):
+        self._last = time.perf_counter()
+
+    def mark(self, phase):
+        if not self.enabled:
+            return
+        if self.sync:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self.times[phase].append(now - self._last)
+        self._last = now
+
+    def percentiles(self, q=(50, 90, 99)):
+        """{phase: [ms at each percentile of q]} for the phases seen so far."""
+        return {
+            phase: np.percentile(1e3 * np.array(times), q).tolist()
+            for phase, times in self.times.items()
+            if times
+        }
+
+    def report(self):
+        """One line of p50/p90/p99 per phase and the data-wait share of the
+        step time."""
+        totals = {phase: sum(times) for phase, times in self.times.items()}
+        step_time = sum(totals.values())
+        phases = ", ".join(
+            f"{phase} {p50:.1f}/{p90:.1f}/{p99:.1f}"
+            for phase, (p50, p90, p99) in self.percentiles().items()
+        )
+        data_share = totals["data"] / max(step_time, 1e-9)
+        return (
+            f"Step time p50/p90/p99 ms over last {len(self.times['data'])} steps - "
+            f"{phases} (data wait {data_share:.0%} of step time)"
+        )
+
+
+class StepProfiler:
+    """torch.profiler over the training steps in [start, end), counted from
+    the start of the run. The Chrome trace (chrome://tracing or Perfetto)
+    is written to `logs_path/trace_rank<rank>_steps<start>-<end>.json`.
+    `steps=None` disables it.
+    """
+
+    def __init__(self, steps, logs_path, device, rank=0):
+        self.start, self.end = steps if steps is not None else (-1, -1)
+        self.path = (
+            Path(logs_path) / f"trace_rank{rank}_steps{self.start}-{self.end}.json"
+        )
+        self.activities = [torch.profiler.ProfilerActivity.CPU]
+        if device.type == "cuda":
+            self.activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self.profiler = None
+
+    def step(self, global_step):
+        """Call at the top of every step, before any of its work. Returns the
+        trace path on the step that closes the window, else None."""
+        if global_step == self.start:
+            self.profiler = torch.profiler.profile(
+                activities=self.activities, record_shapes=True, profile_memory=True
+            )
+            self.profiler.__enter__()
+        elif global_step == self.end:
+            return self.stop()
+        return None
+
+    def stop(self):
+        """Export the trace if the window is open (also for runs that end
+        inside it). Returns the trace path or None."""
+        if self.profiler is None:
+            return None
+        self.profiler.__exit__(None, None, None)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.profiler.export_chrome_trace(str(self.path))
+        self.profiler = None
+        return self.path
@@ -0,0 +1,310 @@
+import argparse
+import csv
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import torch
+from audio_dataset import Config, load_audio, split_chunks, to_model_layout
+from frontend import LFCCFrontend
+from inference import load_model
+from logger import setup_logger
+from metrics import log_odds
+from precision import autocast
+from tqdm import tqdm
+
+logger = setup_logger("score_dir")
+
+AUDIO_EXTENSIONS = {".flac", ".wav", ".ogg", ".mp3"}
+COLUMNS = [
+    "path",
+    "duration_s",
+    "num_chunks",
+    "mean_prob",  # mean chunk spoof probability
+    "max_prob",  # most spoof-like chunk
+    "logit_mean_prob",  # sigmoid of the mean chunk spoof log-odds
+    "error",
+]
+
+
+def find_audio(inputs):
+    """Audio files under the directories in `inputs` (walked recursively) and
+    listed in manifest files (one path per line, relative to the manifest),
+    in a stable order without duplicates."""
+    files = []
+    for item in map(Path, inputs):
+        if item.is_dir():
+            files.extend(
+                sorted(
+                    str(path)
+                    for path in item.rglob("*")
+                    if path.suffix.lower() in AUDIO_EXTENSIONS
+                )
+            )
+        elif item.suffix.lower() in AUDIO_EXTENSIONS:
+            files.append(str(item))
+        else:
+            with open(item) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        files.append(str(item.parent / line))
+    return list(dict.fromkeys(files))
+
+
+def _init_worker():
+    # One thread per decode process, the pool is the parallelism
+    torch.set_num_threads(1)
+
+
+def decode_chunks(file_path, sr, chunk_samples, step_samples):
+    """Runs in the decode pool: (file_path, duration_s, (num_chunks,
+    chunk_samples) float32 array, error). Chunks are cut as AudioDataset
+    cuts them."""
+    try:
+        audio = torch.from_numpy(load_audio(file_path, sr))
+    except Exception as e:
+        return file_path, float("nan"), None, f"{type(e).__name__}: {e}"
+    if audio.dim() != 1:
+        # Anything else would break the whole group's batch
+        error = f"unexpected audio shape {tuple(audio.shape)}"
+        return file_path, float("nan"), None, error
+    chunks = split_chunks(audio, chunk_samples, step_samples)
+    return file_path, len(audio) / sr, chunks.numpy(), ""
+
+
+class CsvResults:
+    """Rows appended to one CSV file and flushed per group of files."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            # Drop a row cut off by an interrupted run
+            with open(self.path, "rb+") as f:
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+        new_file = not self.path.exists() or self.path.stat().st_size == 0
+        self.file = open(self.path, "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS)
+        if new_file:
+            self.writer.writeheader()
+
+    def done_paths(self):
+        with open(self.path, newline="") as f:
+            return {row["path"] for row in csv.DictReader(f)}
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetResults:
+    """Rows written as one Parquet part file per group of files into the
+    directory `path`; each part is renamed into place once complete."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                "Parquet output needs pyarrow: pip install pyarrow"
+            ) from e
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.num_parts = len(list(self.path.glob("part-*.parquet")))
+
+    def done_paths(self):
+        if self.num_parts == 0:
+            return set()
+        table = self.pq.read_table(self.path, columns=["path"])
+        return set(table.column("path").to_pylist())
+
+    def write(self, rows):
+        if not rows:
+            return
+        table = self.pa.Table.from_pylist(rows)
+        part = self.path / f"part-{self.num_parts:05d}.parquet"
+        tmp_part = part.with_name(f".{part.name}.tmp")
+        self.pq.write_table(table, tmp_part)
+        tmp_part.replace(part)
+        self.num_parts += 1
+
+    def close(self):
+        pass
+
+
+def open_results(path):
+    if Path(path).suffix == ".parquet":
+        return ParquetResults(path)
+    return CsvResults(path)
+
+
+class ChunkScorer:
+    """Batched LFCC + model over chunks of many files, aggregated per file."""
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+        self.spoof_idx = config.class2idx["spoof"]
+        self.frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+
+    def log_odds(self, chunks):
+        """(num_chunks, chunk_samples) -> (num_chunks,) spoof log-odds, run in
+        `batch_size` slices."""
+        config = self.config
+        scores = []
+        with torch.no_grad():
+            for batch in chunks.split(config.batch_size):
+                inputs = to_model_layout(self.frontend(batch.to(config.device)))
+                if getattr(config, "channels_last", False):
+                    inputs = inputs.contiguous(memory_format=torch.channels_last)
+                with autocast(config):
+                    outputs = self.model(inputs)
+                scores.append(log_odds(outputs.float(), self.spoof_idx).cpu())
+        return torch.cat(scores) if scores else torch.zeros(0)
+
+    def score_group(self, decoded):
+        """Rows for a group of decoded files; the chunks of all files go
+        through the model together."""
+        scored = [item for item in decoded if item[2] is not None and len(item[2])]
+        rows = {}
+        if scored:
+            chunks = torch.from_numpy(np.concatenate([item[2] for item in scored]))
+            counts = torch.tensor([len(item[2]) for item in scored])
+            owner = torch.repeat_interleave(torch.arange(len(scored)), counts)
+            log_odds = self.log_odds(chunks)
+            probabilities = torch.sigmoid(log_odds)
+
+            def per_file(values, reduce):
+                out = torch.zeros(len(scored))
+                return out.scatter_reduce_(0, owner, values, reduce, include_self=False)
+
+            mean_prob = per_file(probabilities, "mean")
+            max_prob = per_file(probabilities, "amax")
+            logit_mean_prob = torch.sigmoid(per_file(log_odds, "mean"))
+            for idx, (file_path, duration, _, _) in enumerate(scored):
+                rows[file_path] = {
+                    "path": file_path,
+                    "duration_s": duration,
+                    "num_chunks": int(counts[idx]),
+                    "mean_prob": float(mean_prob[idx]),
+                    "max_prob": float(max_prob[idx]),
+                    "logit_mean_prob": float(logit_mean_prob[idx]),
+                    "error": "",
+                }
+        for file_path, duration, chunks, error in decoded:
+            if file_path not in rows:
+                rows[file_path] = {
+                    "path": file_path,
+                    "duration_s": duration,
+                    "num_chunks": 0,
+                    "mean_prob": float("nan"),
+                    "max_prob": float("nan"),
+                    "logit_mean_prob": float("nan"),
+                    "error": error or "no audio",
+                }
+        return [rows[file_path] for file_path, _, _, _ in decoded]
+
+
+def score_files(files, output, model_path, config):
+    """Score `files` into `output` (.csv, or .parquet for a directory of
+    Parquet parts). Files that already have a row there are skipped, so an
+    interrupted run picks up where it stopped. Files are decoded in a pool
+    of `score_workers` processes; decoded files are grouped until they hold
+    `score_group_chunks` chunks, scored together and written out."""
+    results = open_results(output)
+    done = results.done_paths()
+    todo = [file_path for file_path in files if file_path not in done]
+    logger.info(
+        f"{len(files)} files, {len(files) - len(todo)} already scored in {output}"
+    )
+    if not todo:
+        results.close()
+        return
+
+    scorer = ChunkScorer(load_model(model_path, config), config)
+    chunk_samples = int(config.chunk_length * config.sr)
+    step_samples = chunk_samples - int(config.chunk_overlap * config.sr)
+    num_workers = max(1, config.score_workers)
+    num_errors = 0
+    audio_seconds = 0.0
+    progress = tqdm(total=len(todo), desc="Scoring")
+    with ProcessPoolExecutor(
+        max_workers=num_workers, initializer=_init_worker
+    ) as executor:
+        pending = deque()
+        next_file = 0
+        group, group_chunks = [], 0
+        while pending or next_file < len(todo):
+            # Bounded read-ahead keeps decoded audio in memory small
+            while next_file < len(todo) and len(pending) < 4 * num_workers:
+                pending.append(
+                    executor.submit(
+                        decode_chunks,
+                        todo[next_file],
+                        config.sr,
+                        chunk_samples,
+                        step_samples,
+                    )
+                )
+                next_file += 1
+            decoded = pending.popleft().result()
+            group.append(decoded)
+            group_chunks += 0 if decoded[2] is None else len(decoded[2])
+            if group_chunks >= config.score_group_chunks or not (
+                pending or next_file < len(todo)
+            ):
+                rows = scorer.score_group(group)
+                results.write(rows)
+                num_errors += sum(1 for row in rows if row["error"])
+                audio_seconds += sum(
+                    row["duration_s"] for row in rows if not row["error"]
+                )
+                progress.update(len(group))
+                group, group_chunks = [], 0
+    progress.close()
+    results.close()
+    logger.info(
+        f"Scored {len(todo)} files ({audio_seconds / 3600:.2f} h of audio) into "
+        f"{output}, {num_errors} without a score"
+    )
+
+
+if __name__ == "__main__":
+    config = Config()
+    parser = argparse.ArgumentParser(
+        description="Score every audio file under directories or in manifests."
+    )
+    parser.add_argument(
+        "inputs",
+        nargs="+",
+        help="directories to walk, audio files, or manifests (one path per line)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="scores.csv",
+        help="results file: .csv, or .parquet (a directory of part files)",
+    )
+    parser.add_argument(
+        "--model",
+        default=os.path.join(config.save_path, "best_model.pth"),
+        help="checkpoint to score with (default: %(default)s)",
+    )
+    args = parser.parse_args()
+    score_files(find_audio(args.inputs), args.output, args.model, config)
@@ -0,0 +1,191 @@
+import io
+import json
+import random
+import tarfile
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+import torch
+import torchaudio.transforms as T
+from audio_dataset import (
+    AudioDataset,
+    Config,
+    iter_protocol,
+    shard_info,
+    shuffle_buffer,
+    to_model_layout,
+)
+from frontend import LFCCFrontend
+from logger import setup_logger
+from torch.utils.data import DataLoader, IterableDataset
+from tqdm import tqdm
+
+logger = setup_logger("shards")
+
+# Config fields that decide what a shard holds; waveform shards are turned
+# into LFCC at load time, so only the chunking ones apply to them
+CHUNK_FIELDS = ("sr", "chunk_length", "chunk_overlap")
+LFCC_FIELDS = ("n_lfcc", "n_fft", "hop_length")
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def pack_shards(audio_list, config, name):
+    """Write the chunks of `audio_list` into sequential tar shards.
+    Each sample is a `<key>.npy` input (waveform or (n_lfcc, time_frames) LFCC,
+    per `config.shard_content`) plus a `<key>.cls` label. Chunks are shuffled
+    once here so that shard-level shuffling at load time stays well mixed.
+    """
+    if config.shard_content not in ("wave", "lfcc"):
+        raise ValueError(f"Unsupported shard_content: {config.shard_content}")
+
+    shard_dir = Path(config.shard_path)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    dataset = AudioDataset(audio_list, config=replace(config, batched_frontend=True))
+    dataloader = DataLoader(
+        dataset,
+        batch_size=config.batch_size,
+        num_workers=config.num_workers,
+        shuffle=True,
+        generator=torch.Generator().manual_seed(config.seed),
+    )
+    frontend = LFCCFrontend(
+        sample_rate=config.sr,
+        n_lfcc=config.n_lfcc,
+        n_fft=config.n_fft,
+        hop_length=config.hop_length,
+    )
+    dtype = np.float16 if config.shard_content == "lfcc" else np.dtype(config.pcm_dtype)
+
+    shards = []
+    tar = None
+    num_samples = 0
+    for waveforms, labels in tqdm(dataloader, desc=f"Packing {name}"):
+        inputs = waveforms
+        if config.shard_content == "lfcc":
+            with torch.no_grad():
+                inputs = frontend(waveforms)
+        elif dtype == np.int16:
+            inputs = (waveforms * 32768.0).clamp(-32768, 32767)
+        for sample, label in zip(inputs.numpy().astype(dtype), labels.tolist()):
+            if num_samples % config.samples_per_shard == 0:
+                if tar is not None:
+                    tar.close()
+                shards.append(f"{name}-{len(shards):05d}.tar")
+                tar = tarfile.open(shard_dir / shards[-1], "w")
+            buffer = io.BytesIO()
+            np.save(buffer, sample)
+            _add_bytes(tar, f"{num_samples:09d}.npy", buffer.getvalue())
+            _add_bytes(tar, f"{num_samples:09d}.cls", str(int(label)).encode())
+            num_samples += 1
+    if tar is not None:
+        tar.close()
+
+    manifest = {
+        "shards": shards,
+        "num_samples": num_samples,
+        "content": config.shard_content,
+        "dtype": np.dtype(dtype).name,
+        **{field: getattr(config, field) for field in CHUNK_FIELDS + LFCC_FIELDS},
+    }
+    with open(shard_dir / f"{name}.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ShardDataset(IterableDataset):
+    """Reads shards written by `pack_shards` front to back.
+    Shards are shuffled per epoch and dealt round-robin to DataLoader workers
+    and distributed ranks; samples are then mixed in a per-worker shuffle buffer.
+    """
+
+    def __init__(self, config, name, shuffle=False) -> None:
+        super().__init__()
+        self.shard_dir = Path(config.shard_path)
+        with open(self.shard_dir / f"{name}.json") as f:
+            self.manifest = json.load(f)
+        fields = CHUNK_FIELDS
+        if self.manifest["content"] == "lfcc":
+            fields += LFCC_FIELDS
+        for field in fields:
+            if self.manifest.get(field) != getattr(config, field):
+                raise ValueError(
+                    f"Shards {name} were packed with {field}="
+                    f"{self.manifest.get(field)}, but the config has "
+                    f"{getattr(config, field)}; repack them with shards.py"
+                )
+        self.shuffle = shuffle
+        self.shuffle_buffer_size = config.shuffle_buffer_size
+        self.seed = config.seed
+        self.epoch = 0
+        self.return_waveform = (
+            config.batched_frontend and self.manifest["content"] == "wave"
+        )
+
+        self.lfcc = T.LFCC(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            speckwargs={"n_fft": config.n_fft, "hop_length": config.hop_length},
+        )
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def expected_num_chunks(self):
+        return self.manifest["num_samples"]
+
+    def _samples(self, shards):
+        for shard in shards:
+            sample = None
+            with tarfile.open(self.shard_dir / shard, mode="r|") as tar:
+                for member in tar:
+                    data = tar.extractfile(member).read()
+                    if member.name.endswith(".npy"):
+                        sample = np.load(io.BytesIO(data))
+                    else:
+                        yield sample, int(data)
+
+    def __iter__(self):
+        shards = list(self.manifest["shards"])
+        if self.shuffle:
+            random.Random(f"{self.seed}:{self.epoch}").shuffle(shards)
+        shard_id, num_shards = shard_info()
+        samples = self._samples(shards[shard_id::num_shards])
+        if self.shuffle:
+            rng = random.Random(f"{self.seed}:{self.epoch}:{shard_id}")
+            samples = shuffle_buffer(samples, self.shuffle_buffer_size, rng)
+
+        for sample, label in samples:
+            inputs = torch.from_numpy(sample).float()
+            if sample.dtype == np.int16:
+                inputs = inputs / 32768.0
+            label_tensor = torch.tensor(label, dtype=torch.float32)
+            if self.manifest["content"] == "lfcc":
+                yield to_model_layout(inputs), label_tensor
+            elif self.return_waveform:
+                yield inputs, label_tensor
+            else:
+                yield to_model_layout(self.lfcc(inputs)), label_tensor
+
+
+if __name__ == "__main__":
+    config = Config()
+    for name, protocol, audio_dir in [
+        ("train", "ASVspoof2019.PA.cm.train.trn2.txt", "ASVspoof2019_PA_train"),
+        ("dev", "ASVspoof2019.PA.cm.dev.trl2.txt", "ASVspoof2019_PA_dev"),
+    ]:
+        audio_list = list(
+            iter_protocol(
+                Path("../PA/ASVspoof2019_PA_cm_protocols") / protocol,
+                Path("../PA") / audio_dir / "flac",
+            )
+        )
+        manifest = pack_shards(audio_list, config, name)
+        logger.info(
+            f"{name}: {manifest['num_samples']} chunks in {len(manifest['shards'])} shards"
+        )
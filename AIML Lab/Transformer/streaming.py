@@ -0,0 +1,206 @@
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import torch
+from audio_dataset import Config, iter_protocol, load_audio, to_model_layout
+from frontend import LFCCFrontend
+from inference import load_model
+from logger import setup_logger
+from precision import autocast
+
+logger = setup_logger("streaming")
+
+
+@dataclass
+class StreamScore:
+    time: float  # stream position (s) at the end of the scored window
+    probability: float  # spoof probability of the window
+    smoothed: float  # exponential moving average of `probability`
+    latency_ms: float  # cepstrum + model time for this window
+
+
+class StreamingDetector:
+    """Scores live audio that arrives in PCM blocks of any size.
+
+    Each STFT frame is computed once, when its last sample arrives: the
+    samples that do not yet fill a frame are kept as a short tail (under
+    `n_fft` samples), and the filterbank energies of new frames go into a
+    ring buffer holding one model window (`chunk_length` seconds of frames).
+    Every `stream_cadence` seconds of audio the window's cepstrum is taken
+    (the top_db clamp is per window, as for a chunk) and the model is run.
+
+    Frames are not centered, so unlike offline chunks the window edges see
+    real neighbouring audio instead of reflect padding. A pushed block costs
+    one frontend pass over its new frames plus one forward per cadence step
+    it completes, so the wait for a frame's score is bounded by the cadence
+    plus a single forward.
+    """
+
+    def __init__(self, model, config):
+        self.model = model
+        self.config = config
+        self.sr = config.sr
+        self.n_fft = config.n_fft
+        self.hop_length = config.hop_length
+        self.spoof_idx = config.class2idx["spoof"]
+        self.frontend = LFCCFrontend(
+            sample_rate=config.sr,
+            n_lfcc=config.n_lfcc,
+            n_fft=config.n_fft,
+            hop_length=config.hop_length,
+            fused=config.fused_frontend,
+        ).to(config.device)
+
+        # Same number of frames as an offline chunk
+        self.window_frames = int(config.chunk_length * config.sr) // self.hop_length + 1
+        self.cadence_frames = max(
+            1, round(config.stream_cadence * config.sr / self.hop_length)
+        )
+        self.smoothing = config.stream_smoothing
+        self.reset()
+
+    def reset(self):
+        """Start a new stream."""
+        device = self.config.device
+        self._tail = torch.zeros(0, device=device)
+        n_filter = self.frontend.filter_mat.size(1)
+        self._ring = torch.zeros(self.window_frames, n_filter, device=device)
+        self.num_frames = 0
+        self._frames_to_score = self.window_frames
+        self.smoothed = None
+
+    @property
+    def position(self):
+        """Stream time in seconds covered by the frames seen so far."""
+        if self.num_frames == 0:
+            return 0.0
+        return ((self.num_frames - 1) * self.hop_length + self.n_fft) / self.sr
+
+    def _write(self, energies):
+        """Append (frames, n_filter) energies to the ring buffer."""
+        num_new = len(energies)
+        if num_new > self.window_frames:
+            # Only the newest window's worth can still be scored
+            energies = energies[-self.window_frames :]
+        positions = torch.arange(
+            self.num_frames + num_new - len(energies),
+            self.num_frames + num_new,
+            device=self._ring.device,
+        )
+        self._ring.index_copy_(0, positions % self.window_frames, energies)
+        self.num_frames += num_new
+
+    def _score(self):
+        start_time = time.perf_counter()
+        # Oldest frame first
+        window = self._ring.roll(-(self.num_frames % self.window_frames), dims=0)
+        with torch.no_grad():
+            inputs = to_model_layout(self.frontend.cepstrum(window.unsqueeze(0)))
+            if getattr(self.config, "channels_last", False):
+                inputs = inputs.contiguous(memory_format=torch.channels_last)
+            with autocast(self.config):
+                outputs = self.model(inputs)
+            probability = float(
+                torch.softmax(outputs.float(), dim=1)[0, self.spoof_idx]
+            )
+
+        if self.smoothed is None:
+            self.smoothed = probability
+        else:
+            self.smoothed = (
+                self.smoothing * self.smoothed + (1 - self.smoothing) * probability
+            )
+        return StreamScore(
+            time=self.position,
+            probability=probability,
+            smoothed=self.smoothed,
+            latency_ms=1000 * (time.perf_counter() - start_time),
+        )
+
+    def push(self, samples):
+        """Add a block of mono PCM at `sr` (array or tensor of any length).
+        Returns the StreamScores of the windows it completes, oldest first."""
+        samples = torch.as_tensor(
+            samples, dtype=torch.float32, device=self._tail.device
+        )
+        buffer = torch.cat([self._tail, samples.flatten()])
+        if len(buffer) < self.n_fft:
+            self._tail = buffer
+            return []
+        num_new = (len(buffer) - self.n_fft) // self.hop_length + 1
+        frames = buffer.unfold(0, self.n_fft, self.hop_length)[:num_new]
+        self._tail = buffer[num_new * self.hop_length :]
+        with torch.no_grad():
+            energies = self.frontend.filterbank_db(self.frontend.frame_power(frames))
+
+        scores = []
+        offset = 0
+        while offset < num_new:
+            take = min(num_new - offset, self._frames_to_score)
+            self._write(energies[offset : offset + take])
+            offset += take
+            self._frames_to_score -= take
+            if self._frames_to_score == 0:
+                scores.append(self._score())
+                self._frames_to_score = self.cadence_frames
+        return scores
+
+
+def replay(detector, file_path, block_ms=20.0, realtime=False):
+    """Feed `file_path` to `detector` in `block_ms` blocks as a live source
+    would (`realtime=True` also waits for each block's wall-clock time).
+    Returns the emitted scores and the processing time of every block in ms."""
+    audio = load_audio(file_path, detector.sr)
+    block_samples = max(1, int(block_ms * detector.sr / 1000))
+    detector.reset()
+
+    scores = []
+    block_latencies = []
+    stream_start = time.perf_counter()
+    for start_sample in range(0, len(audio), block_samples):
+        block = audio[start_sample : start_sample + block_samples]
+        if realtime:
+            arrival = stream_start + (start_sample + len(block)) / detector.sr
+            time.sleep(max(0.0, arrival - time.perf_counter()))
+        start_time = time.perf_counter()
+        scores.extend(detector.push(block))
+        block_latencies.append(1000 * (time.perf_counter() - start_time))
+    return scores, block_latencies
+
+
+if __name__ == "__main__":
+    config = Config()
+    model = load_model(config.save_path + "/best_model.pth", config)
+    detector = StreamingDetector(model, config)
+    dev_list = list(
+        iter_protocol(
+            Path("../PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.dev.trl2.txt"),
+            Path("../PA/ASVspoof2019_PA_dev/flac"),
+        )
+    )
+
+    all_latencies = []
+    audio_seconds = 0.0
+    for file_path, label in dev_list[:10]:
+        scores, block_latencies = replay(
+            detector, file_path, block_ms=config.stream_block_ms
+        )
+        all_latencies.extend(block_latencies)
+        audio_seconds += detector.position
+        if not scores:
+            logger.info(f"{Path(file_path).name} ({label}): shorter than one window")
+            continue
+        logger.info(
+            f"{Path(file_path).name} ({label}): {len(scores)} windows, "
+            f"final smoothed spoof probability: {scores[-1].smoothed:.3f}"
+        )
+
+    latencies = np.array(all_latencies)
+    logger.info(
+        f"Block processing time - p50: {np.percentile(latencies, 50):.2f} ms, "
+        f"p99: {np.percentile(latencies, 99):.2f} ms, max: {latencies.max():.2f} ms "
+        f"(blocks of {config.stream_block_ms} ms), "
+        f"real-time factor: {latencies.sum() / 1000 / max(audio_seconds, 1e-9):.3f}"
+    )
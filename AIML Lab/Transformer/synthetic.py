@@ -0,0 +1,44 @@
+from pathlib import Path
+
+import numpy as np
+import soundfile as sf
+
+
+def make_corpus(
+    root,
+    num_files=64,
+    sr=16000,
+    min_seconds=1.0,
+    max_seconds=6.0,
+    spoof_ratio=0.5,
+    seed=0,
+):
+    """Write `num_files` FLAC files of random length (noise plus a few tones)
+    and an ASVspoof-style protocol listing them under `root`; the corpus
+    depends only on the arguments.
+    Returns (protocol_path, flac_dir) for `iter_protocol`.
+    """
+    root = Path(root)
+    flac_dir = root / "flac"
+    flac_dir.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    lines = []
+    for file_idx in range(num_files):
+        file_id = f"PA_S_{file_idx:07d}"
+        label = "spoof" if rng.random() < spoof_ratio else "bonafide"
+        num_samples = int(rng.uniform(min_seconds, max_seconds) * sr)
+        tones = rng.uniform(100, sr / 2 - 100, size=3)
+        lines.append(f"PA_0000 {file_id} aaa - {label}\n")
+
+        time = np.arange(num_samples) / sr
+        audio = 0.05 * rng.standard_normal(num_samples)
+        for frequency in tones:
+            audio += 0.1 * np.sin(2 * np.pi * frequency * time)
+        sf.write(
+            flac_dir / f"{file_id}.flac", audio.astype(np.float32), sr, format="FLAC"
+        )
+
+    protocol_path = root / "protocol.txt"
+    protocol_path.write_text("".join(lines))
+    return protocol_path, flac_dir
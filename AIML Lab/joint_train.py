@@ -0,0 +1,385 @@
+import importlib.util
+import sys
+from dataclasses import replace
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import torch
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+ROOT = Path(__file__).resolve().parent
+# The data pipeline, frontend and metrics modules are identical in both model
+# directories; the LCNN copies feed the shared stream
+sys.path.insert(0, str(ROOT / "LFCC_LCNN"))
+
+import audio_dataset as lcnn_dataset
+from audio_dataset import AudioDataset, Config, iter_protocol
+from audio_store import build_lfcc_store, build_pcm_store
+from checkpoint import CheckpointWriter, load_checkpoint, rng_state, set_rng_state
+from frontend import LFCCFrontend
+from logger import setup_logger
+from metrics import MetricsAccumulator
+from precision import autocast, grad_scaler
+from samplers import EpochRandomSampler
+
+# Fields that decide the LFCC features; both models must agree on them
+FEATURE_FIELDS = (
+    "sr",
+    "chunk_length",
+    "chunk_overlap",
+    "n_lfcc",
+    "n_fft",
+    "hop_length",
+)
+
+
+def load_module(name, path):
+    """Import `path` as `name`; both model directories use the same module
+    names (`model`, `audio_dataset`), so they cannot both come from sys.path."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+lcnn_model = load_module("lcnn_model", ROOT / "LFCC_LCNN/model.py")
+transformer_dataset = load_module(
+    "transformer_audio_dataset", ROOT / "Transformer/audio_dataset.py"
+)
+transformer_model = load_module("transformer_model", ROOT / "Transformer/model.py")
+
+
+class JointMember:
+    """One model of the joint run with its own config, optimizer, LR schedule,
+    grad scaler, metrics and checkpoints. `to_model_layout` turns the shared
+    (batch, n_lfcc, time_frames) LFCC into this model's input as a view."""
+
+    def __init__(self, name, model, config, to_model_layout, model_dir):
+        self.name = name
+        self.model = model
+        self.config = config
+        self.to_model_layout = to_model_layout
+        self.save_path = model_dir / config.save_path
+        self.logs_path = model_dir / config.logs_path
+        self.scaler = grad_scaler(config)
+        self.optimizer = None
+        self.scheduler = None
+        self.scheduler_per_step = False
+        self.train_metrics = MetricsAccumulator(device=config.device)
+        self.eval_metrics = MetricsAccumulator(
+            positive_class=config.class2idx["spoof"],
+            num_bins=config.metric_bins,
+            exact=config.exact_metrics,
+            device=config.device,
+        )
+        self.best_eval_loss = float("inf")
+        self.save_epoch = 0
+        self.train_loss_list = []
+        self.eval_loss_list = []
+
+    def state_dict(self):
+        return {
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scheduler": self.scheduler.state_dict(),
+            "scaler": self.scaler.state_dict(),
+            "train_metrics": self.train_metrics.state_dict(),
+            "best_eval_loss": self.best_eval_loss,
+            "save_epoch": self.save_epoch,
+            "train_loss_list": self.train_loss_list,
+            "eval_loss_list": self.eval_loss_list,
+        }
+
+    def load_state_dict(self, state):
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.scheduler.load_state_dict(state["scheduler"])
+        self.scaler.load_state_dict(state["scaler"])
+        self.train_metrics.load_state_dict(state["train_metrics"])
+        self.best_eval_loss = state["best_eval_loss"]
+        self.save_epoch = state["save_epoch"]
+        self.train_loss_list = state["train_loss_list"]
+        self.eval_loss_list = state["eval_loss_list"]
+
+    def model_inputs(self, lfcc):
+        inputs = self.to_model_layout(lfcc)
+        if getattr(self.config, "channels_last", False):
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        return inputs
+
+
+def build_lcnn(config):
+    model = lcnn_model.LCNN(
+        sample_rate=config.sr,
+        n_lfcc=config.n_lfcc,
+        n_fft=config.n_fft,
+        hop_length=config.hop_length,
+        chunk_length=config.chunk_length,
+    ).to(config.device)
+    if config.channels_last:
+        model.network.to(memory_format=torch.channels_last)
+    member = JointMember(
+        "LCNN", model, config, lcnn_dataset.to_model_layout, ROOT / "LFCC_LCNN"
+    )
+    # Same optimizer and schedule as LFCC_LCNN/train.py
+    member.optimizer = torch.optim.Adam(
+        model.parameters(), lr=config.learning_rate, weight_decay=config.weight_decay
+    )
+    member.scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
+        member.optimizer,
+        mode="min",
+        factor=config.scheduler_factor,
+        patience=config.scheduler_patience,
+        min_lr=config.min_lr,
+    )
+    return member
+
+
+def build_transformer(config, steps_per_epoch):
+    model = transformer_model.AudioSpoofTransformer(config).to(config.device)
+    member = JointMember(
+        "Transformer",
+        model,
+        config,
+        transformer_dataset.to_model_layout,
+        ROOT / "Transformer",
+    )
+    # Same optimizer and warmup/cosine schedule as Transformer/train.py
+    member.optimizer = torch.optim.Adam(model.parameters(), lr=config.learning_rate)
+    total_steps = steps_per_epoch * config.num_epochs
+    num_warmup_steps = int(0.1 * total_steps)
+    linear_warmup = torch.optim.lr_scheduler.LinearLR(
+        member.optimizer, start_factor=0.1, end_factor=1.0, total_iters=num_warmup_steps
+    )
+    decay_scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(
+        member.optimizer, T_max=total_steps - num_warmup_steps
+    )
+    member.scheduler = torch.optim.lr_scheduler.SequentialLR(
+        member.optimizer,
+        schedulers=[linear_warmup, decay_scheduler],
+        milestones=[num_warmup_steps],
+    )
+    member.scheduler_per_step = True
+    return member
+
+
+# The shared stream (data mode, batch size, workers, epochs, device) follows
+# the LFCC_LCNN Config; each model's own Config sets its optimizer and paths
+config = Config()
+# One stream, so the Transformer's LR schedule is sized to the shared epochs
+transformer_config = replace(transformer_dataset.Config(), num_epochs=config.num_epochs)
+transformer_config.device = config.device
+for name in FEATURE_FIELDS:
+    if getattr(config, name) != getattr(transformer_config, name):
+        raise ValueError(
+            f"LCNN and Transformer configs disagree on {name}: "
+            f"{getattr(config, name)} vs {getattr(transformer_config, name)}"
+        )
+if config.data_mode not in ("raw", "pcm", "lfcc"):
+    raise ValueError(
+        f"Joint training supports raw/pcm/lfcc data, not {config.data_mode}"
+    )
+
+torch.manual_seed(config.seed)
+logger = setup_logger(
+    "joint_train", log_file=str(ROOT / config.logs_path / "joint_training.log")
+)
+
+# Dataset Preparation
+train_protocol = (
+    ROOT / "PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.train.trn2.txt",
+    ROOT / "PA/ASVspoof2019_PA_train/flac",
+)
+eval_protocol = (
+    ROOT / "PA/ASVspoof2019_PA_cm_protocols/ASVspoof2019.PA.cm.dev.trl2.txt",
+    ROOT / "PA/ASVspoof2019_PA_dev/flac",
+)
+train = list(iter_protocol(*train_protocol))
+eval = list(iter_protocol(*eval_protocol))
+
+store_kwargs = {"train": {}, "dev": {}}
+if config.data_mode == "pcm":
+    store_kwargs["train"]["pcm_store"] = build_pcm_store(train, config, "train")
+    store_kwargs["dev"]["pcm_store"] = build_pcm_store(eval, config, "dev")
+elif config.data_mode == "lfcc":
+    store_kwargs["train"]["lfcc_store"] = build_lfcc_store(train, config, "train")
+    store_kwargs["dev"]["lfcc_store"] = build_lfcc_store(eval, config, "dev")
+
+train_dataset = AudioDataset(train, config=config, **store_kwargs["train"])
+eval_dataset = AudioDataset(eval, config=config, **store_kwargs["dev"])
+logger.info(
+    f"Number of Training samples: {len(train_dataset)} | "
+    f"Number of Evaluation samples: {len(eval_dataset)}"
+)
+
+# Seeded per-epoch sampler, so a resumed run can skip to its position
+train_sampler = EpochRandomSampler(len(train_dataset), seed=config.seed)
+train_dataloader = DataLoader(
+    train_dataset,
+    batch_size=config.batch_size,
+    num_workers=config.num_workers,
+    pin_memory=config.pin_memory,
+    sampler=train_sampler,
+    # Own generator: creating the iterator must not advance the global RNG,
+    # or dropout would diverge after a resume
+    generator=torch.Generator().manual_seed(config.seed),
+)
+eval_dataloader = DataLoader(
+    eval_dataset,
+    batch_size=config.batch_size,
+    num_workers=config.num_workers,
+    pin_memory=config.pin_memory,
+)
+
+# Batched LFCC on the training device when the datasets return waveforms
+frontend = None
+if train_dataset.return_waveform:
+    frontend = LFCCFrontend(
+        sample_rate=config.sr,
+        n_lfcc=config.n_lfcc,
+        n_fft=config.n_fft,
+        hop_length=config.hop_length,
+        fused=config.fused_frontend,
+    ).to(config.device)
+
+
+def shared_lfcc(inputs):
+    """Batch from the shared loader -> (batch, n_lfcc, time_frames) on the
+    device. Computed once per batch and viewed into each model's layout."""
+    inputs = inputs.to(config.device)
+    if frontend is not None:
+        return frontend(inputs)
+    # AudioDataset returned the LCNN layout (batch, 1, n_lfcc, time_frames)
+    return inputs.squeeze(-3)
+
+
+# Model Setup
+members = [
+    build_lcnn(config),
+    build_transformer(transformer_config, steps_per_epoch=len(train_dataloader)),
+]
+logger.info(f"Using device: {config.device}")
+for member in members:
+    member.save_path.mkdir(parents=True, exist_ok=True)
+    num_params = sum(p.numel() for p in member.model.parameters() if p.requires_grad)
+    logger.info(f"{member.name} has {num_params} trainable parameters.")
+
+criterion = torch.nn.CrossEntropyLoss()
+
+
+def training_state(epoch, step):
+    """Everything needed to continue both models from batch `step` of `epoch`."""
+    return {
+        "epoch": epoch,
+        "step": step,
+        "members": {member.name: member.state_dict() for member in members},
+        "rng": rng_state(),
+    }
+
+
+# One checkpoint for both models, so they always resume at the same batch
+checkpoint_path = ROOT / config.save_path / "joint_last_checkpoint.pth"
+checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+checkpoint_writer = CheckpointWriter()
+start_epoch, start_step = 0, 0
+if config.resume and checkpoint_path.exists():
+    state = load_checkpoint(checkpoint_path)
+    for member in members:
+        member.load_state_dict(state["members"][member.name])
+    set_rng_state(state["rng"])
+    start_epoch, start_step = state["epoch"], state["step"]
+    logger.info(
+        f"Resumed from {checkpoint_path} at epoch {start_epoch + 1}, step {start_step}"
+    )
+
+# Training Loop:
+for epoch in range(start_epoch, config.num_epochs):
+    skip_steps = start_step if epoch == start_epoch else 0
+    train_sampler.set_epoch(epoch, start=skip_steps * config.batch_size)
+    for member in members:
+        member.model.train()
+        if skip_steps == 0:
+            member.train_metrics.reset()
+
+    for step, (inputs, targets) in enumerate(
+        tqdm(train_dataloader, desc=f"Epoch {epoch + 1}/{config.num_epochs}"),
+        start=skip_steps,
+    ):
+        lfcc = shared_lfcc(inputs)
+        targets = targets.to(config.device).long()
+
+        for member in members:
+            member.optimizer.zero_grad()
+            with autocast(member.config):
+                outputs = member.model(member.model_inputs(lfcc))
+                loss = criterion(outputs, targets)
+            member.scaler.scale(loss).backward()
+            member.scaler.step(member.optimizer)
+            member.scaler.update()
+            if member.scheduler_per_step:
+                member.scheduler.step()
+            member.train_metrics.add_loss(loss)
+
+        if config.checkpoint_every > 0 and (step + 1) % config.checkpoint_every == 0:
+            checkpoint_writer.save(training_state(epoch, step + 1), checkpoint_path)
+
+    # Evaluation Loop:
+    for member in members:
+        member.model.eval()
+        member.eval_metrics.reset()
+    with torch.no_grad():
+        for inputs, targets in tqdm(eval_dataloader, desc="Evaluating"):
+            lfcc = shared_lfcc(inputs)
+            targets = targets.to(config.device).long()
+            for member in members:
+                with autocast(member.config):
+                    outputs = member.model(member.model_inputs(lfcc))
+                outputs = outputs.float()
+                loss = criterion(outputs, targets)
+                member.eval_metrics.update(outputs, targets, loss)
+
+    for member in members:
+        results = member.eval_metrics.compute()
+        accuracy, eer = results["accuracy"], results["eer"]
+        avg_loss = member.train_metrics.compute()["loss"]
+        avg_eval_loss = results["loss"]
+        current_lr = member.optimizer.param_groups[0]["lr"]
+        logger.info(
+            f"{member.name} Epoch [{epoch + 1}/{config.num_epochs}] - "
+            f"Train_Loss: {avg_loss:.4f}, Eval_Loss: {avg_eval_loss:.4f}, "
+            f"Accuracy: {accuracy:.2f}%%, EER: {eer:.4f}, LR: {current_lr:.2e}"
+        )
+        member.train_loss_list.append(avg_loss)
+        member.eval_loss_list.append(avg_eval_loss)
+
+        if not member.scheduler_per_step:
+            member.scheduler.step(avg_eval_loss)
+        if avg_eval_loss < member.best_eval_loss:
+            member.best_eval_loss = avg_eval_loss
+            checkpoint_writer.save(
+                member.model.state_dict(), member.save_path / "best_model.pth"
+            )
+            logger.info(
+                f"{member.name} best model saved with accuracy: {accuracy:.2f}%%"
+            )
+            member.save_epoch = epoch + 1
+    checkpoint_writer.save(training_state(epoch + 1, 0), checkpoint_path)
+
+checkpoint_writer.close()
+
+for member in members:
+    member.logs_path.mkdir(parents=True, exist_ok=True)
+    plt.figure()
+    epochs = range(1, config.num_epochs + 1)
+    plt.plot(epochs, member.train_loss_list, label="Train Loss")
+    plt.plot(epochs, member.eval_loss_list, label="Eval Loss")
+    plt.axvline(
+        x=member.save_epoch, color="r", linestyle="--", label="Best Model Epoch"
+    )
+    plt.xlabel("Epoch")
+    plt.ylabel("Loss")
+    plt.title(f"{member.name} Training and Evaluation Loss over Epochs")
+    plt.legend()
+    plt.savefig(member.logs_path / "loss_curve.png")